@@ -0,0 +1,49 @@
+#compare how fast the default Flask JSON provider & TheREALJason (orjson) can dump a 10k car catalog
+#run from the project root: python benchmarks/json_dump.py
+import os
+import sys
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite://') #nothing here touches the database
+os.environ.setdefault('IMAGE_WORKERS', '0')
+
+from flask.json.provider import DefaultJSONProvider
+
+from car_inventory import app
+from car_inventory.helpers import TheREALJason, new_id
+
+
+CARS = 10_000
+ROUNDS = 20
+
+catalog = [
+    {
+        'car_id': new_id(),
+        'make': 'Honda',
+        'model': f'Civic {i % 50}',
+        'year': str(1990 + i % 35),
+        'color': ['red', 'blue', 'black', 'white'][i % 4],
+        'image': f'https://images.example.com/cars/{i}.jpg',
+        'description': 'Low miles, one owner, Guy Fieri approved',
+        'price': Decimal('19999.99') + i,
+        'quantity': i % 40,
+        'date_added': datetime(2023, 9, 1, 12, i % 60),
+    }
+    for i in range(CARS)
+]
+
+providers = {
+    'DefaultJSONProvider (json + default hook)': DefaultJSONProvider(app),
+    'TheREALJason (orjson)': TheREALJason(app),
+}
+
+for provider in providers.values():
+    provider.compact = True #benchmark the production (non-debug) output
+
+for name, provider in providers.items():
+    seconds = min(timeit.repeat(lambda: provider.dumps(catalog), number = 1, repeat = ROUNDS))
+    size = len(provider.dumps(catalog))
+    print(f'{name:45} {seconds * 1000:8.1f} ms per dump  {CARS / seconds:12,.0f} cars/s  {size:,} bytes')
@@ -12,13 +12,16 @@ from .blueprints.site.routes import site
 from .blueprints.auth.routes import auth
 from .blueprints.api.routes import api
 from .models import login_manager, db
-from .helpers import TheREALJason
+from .enrichment import image_enricher
+from .commands import stats_cli, idempotency_cli
+from . import cache
+from .helpers import TheREALJason, ImageSearchClient, set_image_client
 
 
 
 app = Flask(__name__)
 app.config.from_object(Config)
-app.json_encoder = TheREALJason
+app.json = TheREALJason(app) #orjson based, handles Decimal/datetime/UUID
 jwt = JWTManager(app) #anywhere in our app, we can use this jwt to protect our routes
 
 
@@ -39,4 +42,9 @@ app.register_blueprint(api)
 
 db.init_app(app)
 migrate = Migrate(app, db)
+set_image_client(ImageSearchClient(app.config['IMAGE_SEARCH_URL'], app.config['IMAGE_SEARCH_KEY']))
+image_enricher.init_app(app) #background image workers, started by the first request in each worker process
+app.cli.add_command(stats_cli)
+app.cli.add_command(idempotency_cli)
+cache.init_app(app)
 CORS(app)
\ No newline at end of file
@@ -1,8 +1,17 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, url_for, stream_with_context
+import functools
+import hashlib
+import re
+from decimal import InvalidOperation
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from sqlalchemy.orm.exc import StaleDataError
 
 #internal imports
-from car_inventory.models import Customer, Car, carOrder, Order, db, car_schema, cars_schema
+from car_inventory.models import Customer, Car, carOrder, Order, CacheVersion, db, car_schema, cars_schema, carSchema, user_cache, car_fields, cars_schema_for, car_filters, car_sort, car_facets, CAR_SORTS
+from car_inventory.helpers import encode_cursor, decode_cursor, json_bytes, compress, compress_stream, ENCODINGS
+from car_inventory.cache import catalog_cache, CachedBody
+from car_inventory.suggest import suggestions
+from car_inventory.idempotency import idempotent
 
 #instantiate our blueprint
 api = Blueprint('api', __name__, url_prefix='/api') #all our endpoints need to be prefixed with API
@@ -30,10 +39,304 @@ def token():
 @jwt_required() # if we don't have this access token, then we can't make an api call
 def get_shop():
 
-    shop = Car.query.all() # list of objects, we can't send a list of objects through api calls
+    #clients poll this constantly, so check the inventory version first: if nothing has changed since
+    #their last copy we answer 304 without loading a single car
+    version = CacheVersion.get(CacheVersion.INVENTORY)
+    etag = shop_etag(version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    #then this worker's cache of already serialized pages for this inventory version
+    key = ('shop', version, request.host, request.query_string)
+    page = catalog_cache.get(key)
+    if page is None:
+        page = shop_page()
+        if not isinstance(page, CachedBody):
+            return page #bad limit or cursor, nothing to cache
+        catalog_cache.set(key, page, len(page))
+
+    response = cached_response(key, page)
+
+    #the version was read before the query, so if a write sneaks in between the client just refetches next time
+    encoding = response.content_encoding
+    response.set_etag(f'{etag}-{encoding}' if encoding else etag) #each encoding is its own representation
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def cached_response(key, page):
+    #send a catalog_cache entry, compressed if the client takes it. The compressed copies are kept on the entry,
+    #so only the first hit per encoding pays for gzip, and the entry is recounted so CATALOG_CACHE_BYTES still covers them
+    encoding = accepted_encoding() if len(page.body) >= current_app.config['COMPRESS_MIN_BYTES'] else None
+    size = len(page)
+    body = page.encoded(encoding, current_app.config['COMPRESS_LEVEL'])
+    if len(page) != size:
+        catalog_cache.resize(key, len(page))
+
+    response = current_app.response_class(body, mimetype=current_app.json.mimetype, headers=page.headers)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.content_encoding = encoding
+    return response
+
+def not_modified(etag):
+    #304 if the client already has this version, in any encoding (the gzip copy's ETag ends in -gzip).
+    #If-None-Match uses the weak comparison (RFC 9110), so W/"inv..." from a client or proxy counts too
+    for variant in [etag] + [f'{etag}-{encoding}' for encoding in ENCODINGS]:
+        if request.if_none_match.contains_weak(variant):
+            response = current_app.response_class(status = 304)
+            response.set_etag(variant)
+            response.vary.add('Accept-Encoding')
+            return response
+    return None
+
+def accepted_encoding():
+    #the best of gzip/deflate the client will take, or None for plain
+    return request.accept_encodings.best_match(ENCODINGS)
+
+def shop_etag(version):
+    #strong ETag: the inventory version plus the query string, since every page/limit is a different body
+    args = hashlib.sha1(request.query_string).hexdigest()[:12]
+    return f'inv{version}-{args}'
+
+def shop_page():
+    #keyset pagination: instead of OFFSET we remember the sort value & car_id of the last car sent
+    #and ask for the rows after it, so every page is an index range scan no matter how big the table is
+    try:
+        limit = int(request.args.get('limit', current_app.config['SHOP_PAGE_SIZE']))
+    except ValueError:
+        return {
+            'status': 400,
+            'message': 'limit must be a number'
+        }, 400
+    limit = max(1, min(limit, current_app.config['SHOP_MAX_PAGE_SIZE']))
+
+    #?make=Honda&min_price=10000&sort=-price: filtered & sorted by the database (see the car indexes)
+    #instead of clients downloading everything to do it themselves
+    sort = request.args.get('sort', 'date_added')
+    try:
+        column, descending = car_sort(sort)
+        filters = car_filters(request.args)
+    except ValueError as error:
+        return {
+            'status': 400,
+            'message': str(error)
+        }, 400
+
+    query = Car.query.filter(*filters)
+    if descending:
+        query = query.order_by(column.desc(), Car.car_id.desc())
+    else:
+        query = query.order_by(column, Car.car_id)
+    schema = cars_schema
+
+    #?fields=car_id,price,quantity: only SELECT & send those columns (plus what the cursor needs)
+    if request.args.get('fields'):
+        try:
+            fields = car_fields(request.args['fields'])
+        except ValueError as error:
+            return {
+                'status': 400,
+                'message': str(error)
+            }, 400
+        query = query.options(db.load_only(*[getattr(Car, field) for field in fields], column))
+        schema = cars_schema_for(fields)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_sort, value, car_id = decode_cursor(cursor)
+            if cursor_sort != sort:
+                raise ValueError('Cursor is for a different sort')
+            value = CAR_SORTS[column.key](value)
+        except (ValueError, InvalidOperation):
+            return {
+                'status': 400,
+                'message': 'Invalid cursor. Start again from the first page'
+            }, 400
+        #(value, car_id) tuple comparison, which the (column, car_id) index can answer directly
+        after = db.tuple_(column, Car.car_id)
+        query = query.filter(after < (value, car_id) if descending else after > (value, car_id))
+
+    shop = query.limit(limit + 1).all() # list of objects, we can't send a list of objects through api calls
+    #we grabbed one extra row just to find out if there is another page
+    has_next = len(shop) > limit
+    shop = shop[:limit]
+
+    body = current_app.json.response(schema.dump(shop)).get_data() #list of objects -> list of dictionaries -> json string
+    headers = {}
+
+    if has_next:
+        last = shop[-1]
+        args = {**request.args.to_dict(), 'limit': limit, 'cursor': encode_cursor(sort, getattr(last, column.key), last.car_id)} #filters, sort & fields carry over
+        next_url = url_for('api.get_shop', **args, _external=True)
+        headers['Link'] = f'<{next_url}>; rel="next"' #body stays a plain list so existing clients keep working
+
+    return CachedBody(body, headers)
+
+@api.route('/shop/export')
+@jwt_required()
+def export_shop():
+
+    #the whole inventory for internal consumers, streamed so memory stays flat however big the catalog gets:
+    #rows come out of the database yield_per at a time (a server side cursor on Postgres),
+    #skip the ORM & marshmallow entirely & get written out one batch per chunk
+    ndjson = request.args.get('format') == 'ndjson'
+
+    version = CacheVersion.get(CacheVersion.INVENTORY)
+    etag = shop_etag(version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        fields = car_fields(request.args['fields']) if request.args.get('fields') else carSchema.Meta.fields
+    except ValueError as error:
+        return {
+            'status': 400,
+            'message': str(error)
+        }, 400
+
+    columns = [getattr(Car, field) for field in fields]
+    stmt = db.select(*columns).order_by(Car.date_added, Car.car_id).execution_options(yield_per = current_app.config['EXPORT_BATCH_SIZE'])
+
+    def generate():
+        result = db.session.execute(stmt).mappings()
+        first = True
+
+        if not ndjson:
+            yield b'['
+        for rows in result.partitions():
+            lines = [json_bytes(dict(row)) for row in rows]
+            if ndjson:
+                yield b'\n'.join(lines) + b'\n'
+            else:
+                yield (b'' if first else b',') + b','.join(lines)
+            first = False
+        if not ndjson:
+            yield b']'
+
+    response = current_app.response_class(stream_with_context(generate()), mimetype = 'application/x-ndjson' if ndjson else 'application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@api.route('/shop/facets')
+@jwt_required()
+def shop_facets():
+
+    #counts for the filter sidebar, for whatever filters are already applied (same parameters as /api/shop)
+    try:
+        filters = car_filters(request.args)
+    except ValueError as error:
+        return {
+            'status': 400,
+            'message': str(error)
+        }, 400
+
+    #one query for every facet, and only once per inventory version & filter set
+    key = ('facets', CacheVersion.get(CacheVersion.INVENTORY), request.query_string)
+    facets = catalog_cache.get(key)
+    if facets is None:
+        counts = car_facets(filters)
+        body = {
+            #makes & colors most common first, decades & price bands in order
+            'make': [{'value': value, 'count': count} for value, count in sorted(counts['make'].items(), key = lambda item: (-item[1], item[0]))],
+            'color': [{'value': value, 'count': count} for value, count in sorted(counts['color'].items(), key = lambda item: (-item[1], item[0]))],
+            'decade': [{'value': value, 'count': count} for value, count in sorted(counts['decade'].items())],
+            'price': [{'value': value, 'count': count} for value, count in sorted(counts['price'].items(), key = lambda item: int(item[0].split('-')[0].rstrip('+')))],
+        }
+        facets = CachedBody(current_app.json.response(body).get_data())
+        catalog_cache.set(key, facets, len(facets))
+
+    return cached_response(key, facets) #compressed from the entry's stored copies, not again on every hit
+
+@api.route('/shop/search')
+@jwt_required()
+def search_shop():
+
+    #?q=red 2019 civic: ranked full text search across make, model, color, year & description
+    terms = re.findall(r'\w+', request.args.get('q', '').lower())[:10] #just the words, so nothing in q can be query syntax
+    if not terms:
+        return {
+            'status': 400,
+            'message': 'Missing search. Try ?q=red civic'
+        }, 400
+
+    try:
+        limit = int(request.args.get('limit', current_app.config['SHOP_PAGE_SIZE']))
+    except ValueError:
+        return {
+            'status': 400,
+            'message': 'limit must be a number'
+        }, 400
+    limit = max(1, min(limit, current_app.config['SHOP_MAX_PAGE_SIZE']))
+
+    #the same search keeps coming back while people type, so results are cached per inventory version like pages
+    key = ('search', CacheVersion.get(CacheVersion.INVENTORY), tuple(terms), limit)
+    results = catalog_cache.get(key)
+    if results is None:
+        results = CachedBody(current_app.json.response(cars_schema.dump(Car.search(terms, limit))).get_data())
+        catalog_cache.set(key, results, len(results))
+
+    return cached_response(key, results) #compressed from the entry's stored copies, not again on every hit
+
+@api.route('/shop/suggest')
+@jwt_required()
+def suggest_shop():
+
+    #autocomplete for the search box, fired on every keystroke, so it's answered from memory without touching the database
+    prefix = request.args.get('q', '').strip()
+    if not prefix:
+        return {
+            'status': 400,
+            'message': 'Missing prefix. Try ?q=ho'
+        }, 400
+
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 50))
+    except ValueError:
+        return {
+            'status': 400,
+            'message': 'limit must be a number'
+        }, 400
+
+    return jsonify(suggestions.suggest(prefix, limit))
+
+@api.after_request
+def compress_response(response):
+    #gzip/deflate any JSON the api sends that's big enough to be worth it (get_shop does its own from the cache)
+    if response.status_code != 200 or response.content_encoding or response.mimetype not in ('application/json', 'application/x-ndjson'):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if not encoding:
+        return response
+
+    level = current_app.config['COMPRESS_LEVEL']
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, level) #no idea how big an export will be, so always
+    elif response.content_length is not None and response.content_length >= current_app.config['COMPRESS_MIN_BYTES']:
+        response.set_data(compress(response.get_data(), encoding, level))
+    else:
+        return response
 
-    response = cars_schema.dump(shop) #takes our list of objects and turns it into a list of dictionaries
-    return jsonify(response) #jsonify essentially stringifies the list to send to our frontend
+    response.content_encoding = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+@api.route('/cache')
+@jwt_required()
+def cache_stats():
+    #hit/miss counters for this worker's caches
+    return {
+        'status': 200,
+        'catalog': catalog_cache.stats(),
+        'users': user_cache.stats()
+    }
 
 #creating our READ data request for orders, READ associated with "GET"
 @api.route('/order/<cust_id>')
@@ -43,16 +346,15 @@ def get_order(cust_id):
     #We need to grab all the order_ids associated with the customer
     #Grab all the products on that particular order
 
-    car_order = carOrder.query.filter(carOrder.cust_id == cust_id).all()
+    #joinedload pulls each line's car in the same SELECT (one JOIN) instead of one extra query per line item
+    car_order = carOrder.query.options(db.joinedload(carOrder.car)).filter(carOrder.cust_id == cust_id).all()
 
     data = []
 
     #need to traverse to grab all the products from each other
     for order in car_order:
-        
-        car = Car.query.filter(Car.car_id == order.car_id).first()
 
-        car_data = car_schema.dump(car)
+        car_data = car_schema.dump(order.car)
 
         car_data['quantity'] = order.quantity
         car_data['order_id'] = order.order_id
@@ -64,12 +366,33 @@ def get_order(cust_id):
 
 @api.route('/order/create/<cust_id>', methods = ['POST'])
 @jwt_required()
+@idempotent #commits for us, together with the saved answer when there's an Idempotency-Key
 def create_order(cust_id):
 
     data = request.json
 
     customer_order = data['order']
 
+    #add up the quantity per car first so a car listed twice is still one stock check
+    lines = {}
+    for car in customer_order:
+        quantity = int(car['quantity'])
+        if quantity <= 0:
+            return {
+                'status': 400,
+                'message': 'Every car on the order needs a quantity of at least 1'
+            }, 400
+        lines[car['car_id']] = lines.get(car['car_id'], 0) + quantity
+
+    #take the stock before anything else so a short order leaves nothing behind when we roll back
+    if not Car.decrement_stock(lines):
+        db.session.rollback()
+        return {
+            'status': 409,
+            'message': 'Not enough stock to fill this order',
+            'unfulfilled': Car.stock_shortfalls(lines)
+        }, 409
+
     customer = Customer.query.filter(Customer.cust_id == cust_id).first()
     if not customer:
         customer = Customer(cust_id)
@@ -78,75 +401,99 @@ def create_order(cust_id):
     order = Order()
     db.session.add(order)
 
-    for car in customer_order:
-
-        car_order = carOrder(car['car_id'], car['quantity'], car['price'], order.order_id, customer.cust_id)
-        db.session.add(car_order)
-
-        order.increment_order_total(car_order.price)
-
-        current_car = Car.query.filter(Car.car_id == car['car_id']).first()
-        current_car.decrement_quantity(car['quantity'])
-
-    db.session.commit()
+    order.order_total = carOrder.bulk_create(order.order_id, customer.cust_id, customer_order)
 
     return {
         'status': 200,
         'message': 'New Order was created!'
     }
 
+def retry_on_conflict(view):
+    #Car & Order are optimistically locked (version_id), so a write that raced another one fails with StaleDataError
+    #instead of silently overwriting it. Throw the session away & run the whole view again against the fresh rows,
+    #and if we keep losing, tell the client rather than retrying forever
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        for attempt in range(current_app.config['CONFLICT_RETRIES']):
+            try:
+                return view(*args, **kwargs)
+            except StaleDataError:
+                db.session.rollback()
+        return {
+            'status': 409,
+            'message': 'This order is being changed by someone else right now. Please try again'
+        }, 409
+    return wrapper
+
 @api.route('/order/update/<order_id>', methods=['PUT','POST'])
 @jwt_required()
+@retry_on_conflict
 def update_order(order_id):
-    try:
 
-        data = request.json
+    data = request.json or {}
+    try:
         new_quantity = int(data['quantity'])
         car_id = data['car_id']
+    except (KeyError, TypeError, ValueError):
+        return {
+            'status': 400,
+            'message': 'Unable to process your request.  Please try again'
+        }, 400
+    if new_quantity <= 0:
+        return {
+            'status': 400,
+            'message': 'Quantity must be at least 1. To remove a car use /api/order/delete'
+        }, 400
 
-        car_order = carOrder.query.filter(carOrder.order_id == order_id, carOrder.car_id == car_id).first()
-        order = Order.query.get(order_id)
-        car = Car.query.get(car_id)
-
-        car_order.set_price(car.price, new_quantity)
-
-        diff = abs(car_order.quantity - new_quantity)
-
-        if car_order < new_quantity:
-            car.decrement_quantity(diff)
-            order.increment_order_total(car_order.price)
-        
-        elif car_order > new_quantity:
-            car.increment_quantity(diff)
-            order.decrement_order_total(car_order.price)
-
-        car_order.update_quantity(new_quantity)
+    car_order = carOrder.query.filter(carOrder.order_id == order_id, carOrder.car_id == car_id).first()
+    if car_order is None:
+        return {
+            'status': 404,
+            'message': 'That car is not on this order'
+        }, 404
+    order = db.session.get(Order, order_id)
+    car = db.session.get(Car, car_id)
+
+    #positive diff takes more cars out of stock, negative puts them back
+    diff = new_quantity - car_order.quantity
+    if diff > car.quantity:
+        return {
+            'status': 409,
+            'message': 'Not enough stock to fill this order',
+            'unfulfilled': [{'car_id': car_id, 'requested': diff, 'available': car.quantity}]
+        }, 409
 
-        db.session.commit()
+    old_price = car_order.price
+    car_order.set_price(car.price, new_quantity)
+    car_order.update_quantity(new_quantity)
+    car.decrement_quantity(diff)
+    order.decrement_order_total(old_price)
+    order.increment_order_total(car_order.price)
 
-        return {
-            'status': 200,
-            'message': 'Order was successfully updated!'
-        }
-    
-    except:
+    db.session.commit() #StaleDataError here if the car or order changed since we read them
 
-        return{
-            'status': 400,
-            'message': 'Unable to process your request.  Please try again'
-        }
+    return {
+        'status': 200,
+        'message': 'Order was successfully updated!'
+    }
     
 @api.route('/order/delete/<order_id>', methods=['DELETE'])
 @jwt_required()
+@retry_on_conflict
 def delete_car_order(order_id):
 
-    data = request.json
-    car_id = data['car_id']
+    data = request.json or {}
+    car_id = data.get('car_id')
 
     car_order = carOrder.query.filter(carOrder.order_id == order_id, carOrder.car_id == car_id).first()
+    if car_order is None:
+        return {
+            'status': 404,
+            'message': 'That car is not on this order'
+        }, 404
 
-    order = Order.query.get(order_id)
-    car = Car.query.get(car_id)
+    order = db.session.get(Order, order_id)
+    car = db.session.get(Car, car_id)
 
     order.decrement_order_total(car_order.price)
     car.increment_quantity(car_order.quantity)
@@ -157,4 +504,4 @@ def delete_car_order(order_id):
     return {
         'status': 200,
         'message': 'Order was successfully deleted!'
-    }
\ No newline at end of file
+    }
@@ -1,7 +1,10 @@
 from flask import Blueprint, render_template, request, flash, redirect
+from markupsafe import Markup
+from sqlalchemy.orm.exc import StaleDataError
 
 #internal imports
-from car_inventory.models import Car, Customer, Order, db, car_schema, cars_schema 
+from car_inventory.models import Car, ShopStats, CacheVersion, db, car_schema, cars_schema 
+from car_inventory.cache import catalog_cache
 from car_inventory.forms import CarForm
 
 
@@ -12,17 +15,23 @@ site = Blueprint('site', __name__, template_folder='site_templates')
 @site.route('/')
 def shop():
 
-    shop = Car.query.all()
-    customers = Customer.query.all()
-    orders = Order.query.all()
+    #the listing only changes when the inventory does, so each worker keeps its rendered cards per inventory version:
+    #one string that is both what gets sent & what it costs in the cache
+    version = CacheVersion.get(CacheVersion.INVENTORY)
+    listing = catalog_cache.get(('listing', version))
+    if listing is None:
+        listing = Markup(render_template('shop_cars.html', shop=Car.query.all()))
+        catalog_cache.set(('listing', version), listing, len(listing))
+
+    stats = ShopStats.current() #one row instead of counting three tables
 
     shop_stats = {
-        'cars': len(shop),
-        'sales': -sum([order.order_total for order in orders]), #My sum is negative when purchases are made; hacky solution for now
-        'customers': len(customers)
+        'cars': stats.cars,
+        'sales': -stats.gross_sales, #My sum is negative when purchases are made; hacky solution for now
+        'customers': stats.customers
     }
 
-    return render_template('shop.html', shop=shop, stats=shop_stats) #basically displaying our shop.html page
+    return render_template('shop.html', listing=listing, stats=shop_stats) #basically displaying our shop.html page
 
 #create our CREATE route
 @site.route('/shop/create', methods=['GET','POST'])
@@ -60,29 +69,42 @@ def create():
 def update(id):
 
     updateform = CarForm()
-    Car = Car.query.get(id) #Essentially a WHERE clause, WHERE Car.prod_id == id
+    car = db.get_or_404(Car, id) #Essentially a WHERE clause, WHERE Car.prod_id == id
 
     if request.method == 'POST' and updateform.validate_on_submit():
 
+        #someone else saved this car after our form was opened: don't overwrite their changes with what we saw
+        if updateform.version_id.data and updateform.version_id.data != str(car.version_id):
+            flash(f'{car.color} {car.year} {car.make} {car.model} was changed by someone else while you were editing. Please check it and try again', category='warning')
+            return redirect(f'/shop/update/{id}')
+
         try:
             car.make = updateform.make.data
             car.model = updateform.model.data
             car.year = updateform.year.data
             car.color = updateform.color.data
-            car.desciption = updateform.description.data
-            car.set_image(updateform.image.data, updateform.model.data, updateform.make.data, updateform.year.data, updateform.color.data) #calling upon that set_image method to set our image!
+            car.description = updateform.description.data
+            car.image = car.set_image(updateform.image.data, updateform.model.data, updateform.make.data, updateform.year.data, updateform.color.data) #calling upon that set_image method to set our image!
             car.price = updateform.price.data
             car.quantity = updateform.quantity.data
 
-            db.session.commit() #commits the changes
+            db.session.commit() #commits the changes, StaleDataError if the car changed since we loaded it
 
             flash(f'You have successfully updated {car.color} {car.year} {car.make} {car.model}!', category='success')
             return redirect('/')
+
+        except StaleDataError:
+            db.session.rollback()
+            flash('This car was changed by someone else at the same time. Please check it and try again', category='warning')
+            return redirect(f'/shop/update/{id}')
         
         except:
+            db.session.rollback()
             flash('We were unable to process your request.  Please try again', category='warning')
-            return redirect('/shop/create')
-        
+            return redirect(f'/shop/update/{id}')
+
+    if not updateform.version_id.data: #a failed submit keeps the version it was opened with
+        updateform.version_id.data = car.version_id
     return render_template('update.html', form=updateform, car=car)
 
 
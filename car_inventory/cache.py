@@ -0,0 +1,134 @@
+import os
+import threading
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+#internal imports
+from .models import CacheVersion, db, user_cache
+from .helpers import LRUCache, compress
+
+
+
+class CachedBody():
+    #a serialized response body plus the headers that have to go out with it,
+    #and its gzip/deflate versions once someone has asked for them, so cache hits never recompress
+    def __init__(self, body, headers = None):
+        self.body = body
+        self.headers = headers or {}
+        self.compressed = {}
+
+    def encoded(self, encoding, level = 6):
+        if encoding is None:
+            return self.body
+        if encoding not in self.compressed:
+            self.compressed[encoding] = compress(self.body, encoding, level)
+        return self.compressed[encoding]
+
+    def __len__(self):
+        #what it costs in the cache: the body plus every compressed copy made so far
+        return len(self.body) + sum(len(copy) for copy in self.compressed.values())
+
+
+class InvalidationBus():
+
+    """
+    Lets every cache in every gunicorn worker find out when the data behind it changed.
+    Publishing is just bumping a cache_version row inside the writer's transaction (CacheVersion.bump),
+    so there's nothing extra to run: the worker that wrote hears about it as soon as it commits,
+    every other worker notices the new version the next time it polls the table (INVALIDATION_POLL_SECONDS).
+    """
+
+    def __init__(self):
+        self.app = None
+        self.subscribers = defaultdict(list) #version name -> callbacks
+        self.versions = None #last versions this worker has seen
+        self.pid = None #the poller is started per process, gunicorn forks after the app is imported
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_seconds = app.config['INVALIDATION_POLL_SECONDS']
+        app.before_request(self.start_polling)
+
+    def subscribe(self, name, callback, local = True):
+        #local=False for caches this worker keeps up to date itself from its own writes,
+        #they only need to hear when some other worker changed things
+        self.subscribers[name].append((callback, local))
+
+    def publish(self, name, remote = True):
+        #run this worker's callbacks for one name
+        for callback, local in self.subscribers[name]:
+            if remote or local:
+                callback()
+
+    def committed(self, name, previous, version):
+        #this worker's own commit moved name from previous to version. Noting it means the poller won't report it again,
+        #but if we'd last seen something other than previous then another worker wrote in between & that has to go out as remote
+        seen = self.versions.get(name) if self.versions is not None else None
+        if self.versions is not None:
+            self.versions[name] = max(version, seen or 0)
+        self.publish(name, remote = seen != previous)
+
+    def start_polling(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.versions = None
+                threading.Thread(target = self.poll_forever, name = 'invalidation-bus', daemon = True).start()
+
+    def poll_forever(self):
+        failing = False
+        while True:
+            try:
+                with self.app.app_context():
+                    self.poll()
+                failing = False
+            except Exception:
+                if not failing: #log once, not every couple of seconds
+                    self.app.logger.exception('Could not poll cache_version for invalidations')
+                failing = True
+            threading.Event().wait(self.poll_seconds)
+
+    def poll(self):
+        versions = dict(db.session.execute(db.select(CacheVersion.name, CacheVersion.version)).all())
+        previous, self.versions = self.versions, versions
+
+        if previous is None: #first look, nothing to compare against yet
+            return
+        for name, version in versions.items():
+            if previous.get(name) != version:
+                self.publish(name)
+
+
+bus = InvalidationBus()
+
+#serialized catalog responses (/api/shop pages & the / listing), keyed by inventory version
+catalog_cache = LRUCache()
+#entries are keyed by version so they'd never be served stale anyway,
+#clearing just frees the memory as soon as a car change is committed
+bus.subscribe(CacheVersion.INVENTORY, catalog_cache.clear)
+#Flask-Login's user lookups (see load_user), dropped whenever any user row changes
+bus.subscribe(CacheVersion.USERS, user_cache.clear)
+
+
+def init_app(app):
+    catalog_cache.max_entries = app.config['CATALOG_CACHE_ENTRIES']
+    catalog_cache.max_bytes = app.config['CATALOG_CACHE_BYTES']
+    user_cache.max_entries = app.config['USER_CACHE_ENTRIES']
+    user_cache.ttl = app.config['USER_CACHE_SECONDS']
+    bus.init_app(app)
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_bumped_versions(session):
+    #the writing worker doesn't wait for its own poll
+    for name, (previous, version) in session.info.pop('bumped_versions', {}).items():
+        bus.committed(name, previous, version)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_bumped_versions(session):
+    session.info.pop('bumped_versions', None)
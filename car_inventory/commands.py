@@ -0,0 +1,50 @@
+import click
+from datetime import datetime
+from flask.cli import AppGroup
+
+#internal imports
+from .models import ShopStats, IdempotencyKey, db
+
+
+
+#flask shop-stats rebuild / flask shop-stats verify
+stats_cli = AppGroup('shop-stats', help='Maintain the shop_stats summary row.')
+
+
+@stats_cli.command('rebuild')
+def rebuild_stats():
+    """Recount shop_stats from the car, customer & order tables."""
+    drift = ShopStats.rebuild()
+    db.session.commit()
+
+    for field, (was, now) in drift.items():
+        click.echo(f'{field}: {was} -> {now}')
+    click.echo(f'shop_stats rebuilt, {len(drift)} field(s) had drifted')
+
+
+@stats_cli.command('verify')
+def verify_stats():
+    """Compare shop_stats with a fresh count & exit non-zero if they disagree."""
+    row = db.session.get(ShopStats, ShopStats.ROW_ID)
+    if row is None:
+        raise click.ClickException('shop_stats has not been built yet, run `flask shop-stats rebuild`')
+
+    drift = row.drift(ShopStats.compute())
+    for field, (stored, actual) in drift.items():
+        click.echo(f'{field}: stored {stored}, actual {actual}')
+
+    if drift:
+        raise click.ClickException(f'{len(drift)} field(s) have drifted, run `flask shop-stats rebuild`')
+    click.echo('shop_stats matches the database')
+
+
+#flask idempotency-keys purge
+idempotency_cli = AppGroup('idempotency-keys', help='Maintain the saved Idempotency-Key answers.')
+
+
+@idempotency_cli.command('purge')
+def purge_idempotency_keys():
+    """Delete Idempotency-Key rows whose answer or lease has expired."""
+    result = db.session.execute(db.delete(IdempotencyKey.__table__).where(IdempotencyKey.expires_at <= datetime.utcnow()))
+    db.session.commit()
+    click.echo(f'{result.rowcount} expired idempotency key(s) deleted')
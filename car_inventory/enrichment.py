@@ -0,0 +1,130 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+#internal imports
+from .models import db, ImageLookup
+from .helpers import get_image, ImageNotFound
+
+
+
+class ImageEnricher():
+
+    """
+    Background workers that fill in Car.image.
+    Cars are saved right away with a placeholder & an ImageLookup row,
+    a dispatcher thread claims queued rows & a small thread pool runs the searches.
+    """
+
+    LEASE = timedelta(minutes=5) #a claimed row becomes available again after this, in case the worker holding it died
+
+    def __init__(self, app = None):
+        self.app = None
+        self.wakeup = threading.Event()
+        self.pid = None #the workers are started per process, gunicorn forks after the app is imported
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config['IMAGE_WORKERS']
+        self.max_attempts = app.config['IMAGE_LOOKUP_MAX_ATTEMPTS']
+        self.poll_seconds = app.config['IMAGE_LOOKUP_POLL_SECONDS']
+
+        if self.workers:
+            #nothing starts at import: `flask db ...` & other CLI commands never run any workers,
+            #and under gunicorn --preload every forked worker starts its own instead of the master holding them
+            app.before_request(self.start)
+
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.wakeup = threading.Event()
+
+            #wake the dispatcher as soon as a transaction that queued a lookup commits
+            if not event.contains(Session, 'after_flush', self._note_new_lookups):
+                event.listen(Session, 'after_flush', self._note_new_lookups)
+                event.listen(Session, 'after_commit', self._wake_on_commit)
+
+            self.executor = ThreadPoolExecutor(max_workers = self.workers, thread_name_prefix = 'image-lookup')
+            threading.Thread(target = self.dispatch, name = 'image-lookup-dispatch', daemon = True).start()
+
+    def _note_new_lookups(self, session, flush_context):
+        if any(isinstance(obj, ImageLookup) for obj in session.new):
+            session.info['image_lookups_queued'] = True
+
+    def _wake_on_commit(self, session):
+        if session.info.pop('image_lookups_queued', False):
+            self.wakeup.set()
+
+    def dispatch(self):
+        #the timeout doubles as the sweep that picks up retries & anything left over from before a restart
+        while True:
+            self.wakeup.wait(timeout = self.poll_seconds)
+            self.wakeup.clear()
+
+            try:
+                with self.app.app_context():
+                    claimed = self.claim(limit = self.workers * 4)
+            except Exception:
+                self.app.logger.exception('Could not read the image lookup queue')
+                continue
+
+            for lookup_id in claimed:
+                self.executor.submit(self.run_lookup, lookup_id)
+
+    def claim(self, limit):
+        now = datetime.utcnow()
+        candidates = db.session.query(ImageLookup.lookup_id).filter(ImageLookup.available_at <= now).order_by(ImageLookup.available_at).limit(limit).all()
+
+        claimed = []
+        for (lookup_id,) in candidates:
+            #conditional UPDATE so two processes can't both claim the same row
+            result = db.session.execute(
+                db.update(ImageLookup.__table__)
+                .where(ImageLookup.lookup_id == lookup_id, ImageLookup.available_at <= now)
+                .values(available_at = now + self.LEASE, attempts = ImageLookup.attempts + 1)
+            )
+            if result.rowcount:
+                claimed.append(lookup_id)
+
+        db.session.commit()
+        return claimed
+
+    def run_lookup(self, lookup_id):
+        with self.app.app_context():
+            lookup = db.session.get(ImageLookup, lookup_id)
+            if lookup is None: #the car was deleted while we were waiting
+                return
+
+            try:
+                image = get_image(lookup.search)
+            except ImageNotFound:
+                db.session.delete(lookup) #the search came back empty, retrying won't change that
+                db.session.commit()
+                return
+            except Exception:
+                self.app.logger.exception(f'Image lookup failed for {lookup.search!r}')
+
+                if lookup.attempts >= self.max_attempts:
+                    db.session.delete(lookup) #give up, the car keeps its placeholder
+                else:
+                    lookup.available_at = datetime.utcnow() + timedelta(seconds = 2 ** lookup.attempts * 10) #back off before trying again
+                db.session.commit()
+                return
+
+            lookup.car.image = image
+            db.session.delete(lookup)
+            db.session.commit()
+
+
+image_enricher = ImageEnricher()
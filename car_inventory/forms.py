@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm 
-from wtforms import StringField, PasswordField, SubmitField, BooleanField, IntegerField, DecimalField
+from wtforms import StringField, PasswordField, SubmitField, BooleanField, IntegerField, DecimalField, HiddenField
 from wtforms.validators import DataRequired, EqualTo, Email 
 
 
@@ -32,4 +32,5 @@ class CarForm(FlaskForm):
     description = StringField('Product Description **Optional**')
     price = DecimalField('Price', validators=[DataRequired()])
     quantity = IntegerField('Quantity', validators=[DataRequired()])
+    version_id = HiddenField() #the car's version when the form was opened, so an update can tell if someone else saved first
     submit = SubmitField('Submit')
@@ -1,30 +1,298 @@
-import requests
 import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import decimal
 import json
+import orjson
+from flask.json.provider import JSONProvider
+import base64
+import gzip
+import os
+import zlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
 
 
-requests_cache.install_cache(cache_name = 'image_cache', backend = 'sqlite', expire_after=900)
+MISS_TTL = 120 #seconds we remember that a search found no image before asking the API again
+
+_lookup_lock = threading.Lock()
+_lookups_in_flight = {} #search key -> Future shared by everyone asking for the same image right now
+_misses = {} #search key -> when we're allowed to try that search again
+
+
+class ImageNotFound(Exception):
+    pass
+
 
 def get_image(search):
+    #normalizing means 'Red2019HondaCivic' & 'red2019hondacivic' count as the same search
+    key = ''.join(search.split()).lower()
+
+    with _lookup_lock:
+        if _misses.get(key, 0) > time.monotonic():
+            raise ImageNotFound(search)
+
+        #single-flight: the first caller does the request, anyone else asking for the same key waits on its result
+        lookup = _lookups_in_flight.get(key)
+        leader = lookup is None
+        if leader:
+            lookup = _lookups_in_flight[key] = Future()
+
+    if not leader:
+        return lookup.result()
+
+    try:
+        img_url = search_image(key)
+    except ImageNotFound as error:
+        with _lookup_lock:
+            if len(_misses) > 1000: #don't let old misses pile up forever
+                now = time.monotonic()
+                for stale in [k for k, until in _misses.items() if until <= now]:
+                    del _misses[stale]
+            _misses[key] = time.monotonic() + MISS_TTL
+        lookup.set_exception(error)
+        raise
+    except Exception as error:
+        lookup.set_exception(error) #network trouble isn't cached, the next caller gets to try again
+        raise
+    else:
+        lookup.set_result(img_url)
+        return img_url
+    finally:
+        with _lookup_lock:
+            del _lookups_in_flight[key]
+
+
+class ImageSearchClient():
+
+    """
+    Talks to the image search API over one pooled, keep-alive session.
+    Responses are cached for 15 minutes on this session only,
+    so the rest of the app's requests calls aren't touched by the cache.
+    Pass a different url (or session) to point it somewhere else, e.g. a local stand-in server in tests.
+    """
+
+    def __init__(self, url, api_key, host = 'google-search72.p.rapidapi.com', session = None,
+                 timeout = (3.05, 10), pool_size = 10, retries = 3, backoff = 0.5):
+        self.url = url
+        self.timeout = timeout #(connect, read) seconds
+
+        if session is None:
+            session = requests_cache.CachedSession(cache_name = 'image_cache', backend = 'sqlite', expire_after = 900)
+            #retry with exponential backoff on connection errors & the status codes that mean "try again later"
+            retry = Retry(total = retries, backoff_factor = backoff, status_forcelist = (429, 500, 502, 503, 504), allowed_methods = ['GET'])
+            adapter = HTTPAdapter(pool_maxsize = pool_size, pool_block = True, max_retries = retry)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+
+        self.session.headers.update({
+            "X-RapidAPI-Key": api_key,
+            "X-RapidAPI-Host": host
+        })
+
+    def search(self, search):
+        querystring = {"q":search,"gl":"us","lr":"lang_en","num":"1","start":"0"}
+
+        response = self.session.get(self.url, params=querystring, timeout=self.timeout)
+        response.raise_for_status()
+
+        data = response.json()
+        if not data.get('items'):
+            raise ImageNotFound(search)
+        img_url = data['items'][0]['originalImageUrl'] #traversing data dictionary to get the image url that we want
+        return img_url
+
+
+_image_client = None
+
+def set_image_client(client):
+    global _image_client
+    _image_client = client
+
+def search_image(search):
+    if _image_client is None:
+        raise RuntimeError('No image search client configured, call set_image_client() first')
+    return _image_client.search(search)
+
+#response compression with what the standard library has: gzip & deflate (zlib format, which is what HTTP calls deflate)
+ENCODINGS = ['gzip', 'deflate']
+
+def compress(body, encoding, level = 6):
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel = level, mtime = 0) #mtime=0 so the same body always gives the same bytes
+    return zlib.compress(body, level)
+
+def compress_stream(chunks, encoding, level = 6):
+    #compress a streamed body chunk by chunk; the sync flush after each chunk keeps it streaming instead of buffering
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'): #let the wrapped stream clean up (e.g. close its database cursor) if the client goes away
+            chunks.close()
+
+def uuid7():
+    #RFC 9562 UUIDv7: 48 bits of unix time in milliseconds up front so newer keys sort after older ones
+    #(inserts land at the end of the primary key index instead of on a random page), then 74 random bits
+    millis = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), 'big')
+
+    value = (millis & 0xFFFF_FFFF_FFFF) << 80 #unix_ts_ms
+    value |= 0x7 << 76 #version
+    value |= ((rand >> 62) & 0xFFF) << 64 #rand_a
+    value |= 0b10 << 62 #variant
+    value |= rand & 0x3FFF_FFFF_FFFF_FFFF #rand_b
+    return uuid.UUID(int = value)
+
+def new_id():
+    #every primary key we generate comes from here
+    return str(uuid7())
+
+#cursors for keyset pagination are the sort in use plus the sort key of the last row we sent,
+#made opaque so clients don't build them by hand
+def encode_cursor(sort, value, car_id):
+    value = value.isoformat() if isinstance(value, datetime) else str(value) #Decimal/datetime don't survive json as themselves
+    raw = json.dumps([sort, value, car_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    #-> (sort, value as a string, car_id), the caller knows how to parse the value for its sort
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort, value, car_id = json.loads(raw)
+        return str(sort), str(value), str(car_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor') #one error type for the route to catch no matter how the token was mangled
+
+class LRUCache():
+
+    """
+    Small in-process cache, one per worker.
+    Bounded by number of entries & by total size (in bytes, as reported when the value is stored),
+    the least recently used entries get evicted first.
+    Entries can also expire after ttl seconds.
+    Keeps hit/miss counters so we can see if it's pulling its weight.
+    """
+
+    def __init__(self, max_entries = 256, max_bytes = None, ttl = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() #key -> (value, size, expires), oldest first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self.size -= self.entries.pop(key)[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size = 0):
+        with self.lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                return value #bigger than the whole cache, don't evict everything for it
+
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size, time.monotonic() + self.ttl if self.ttl else None)
+            self.size += size
+            self._evict()
+            return value
+
+    def resize(self, key, size):
+        #an entry grew after it was cached (e.g. a compressed copy was added), count its new size against max_bytes
+        with self.lock:
+            if key not in self.entries: #evicted or cleared in the meantime, nothing to count
+                return
+            value, old_size, expires = self.entries[key]
+            self.entries[key] = (value, size, expires)
+            self.size += size - old_size
+            self._evict()
+
+    def _evict(self):
+        #oldest first until we're back under both limits, the lock is already held
+        while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+            _, (_, evicted_size, _) = self.entries.popitem(last = False)
+            self.size -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+def _orjson_default(obj):
+    #orjson only calls back for types it doesn't know, which for us is just Decimal (prices)
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def json_bytes(obj):
+    #compact one line JSON, for streaming (NDJSON lines, chunks of an array) where pretty printing would break things
+    return orjson.dumps(obj, default=_orjson_default)
+
+
+class TheREALJason(JSONProvider):
 
-    url = "https://google-search72.p.rapidapi.com/imagesearch"
+    """
+    Flask JSON provider built on orjson.
+    datetime, date, UUID & dataclasses are serialized natively in C,
+    Decimal goes out as a string like Flask's default provider does.
+    """
 
-    querystring = {"q":search,"gl":"us","lr":"lang_en","num":"1","start":"0"}
+    mimetype = 'application/json'
+    sort_keys = True #same key order as Flask's default provider, so bodies (& ETags) don't change
+    compact = None #None means pretty print in debug mode, like jsonify always has
 
-    headers = {
-        "X-RapidAPI-Key": "ea104aa93amsh4d59e1dddb29571p11bd0djsn261ad6148142",
-        "X-RapidAPI-Host": "google-search72.p.rapidapi.com"
-    }
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            options |= orjson.OPT_INDENT_2
+        return options
 
-    response = requests.get(url, headers=headers, params=querystring)
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default, option=self._options()).decode()
 
-    data = response.json()
-    img_url = data['items'][0]['originalImageUrl'] #traversing data dictionary to get the image url that we want
-    return img_url
+    def loads(self, s, **kwargs):
+        if kwargs: #orjson has no object_hook etc., which Flask's session cookie needs to get its tuples back
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
 
-class TheREALJason(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, decimal.Decimal):
-            return str(obj)
-        return json.JSONEncoder(TheREALJason, self).default(obj) #if it's not decimal then the regular jsonencoder is just fine
\ No newline at end of file
+    def response(self, *args, **kwargs):
+        #skip the bytes -> str -> bytes round trip the base class would do
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_orjson_default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
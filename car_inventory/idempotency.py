@@ -0,0 +1,172 @@
+import functools
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, request, make_response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+
+#internal imports
+from .models import IdempotencyKey, db
+
+
+
+#keys this worker is running right now -> an Event set when it's done, so duplicates in the same worker don't have to poll
+_running = {}
+_running_lock = threading.Lock()
+
+
+def idempotent(view):
+    #POST views that clients retry on timeouts. With an Idempotency-Key header the first request claims the key by inserting
+    #its row, runs, and saves its answer in the same transaction as whatever it created; a retry gets that answer back
+    #instead of running again, and a duplicate that turns up while the first is still running waits for it.
+    #Failed requests (anything but 2xx) give the key back so the client can try again with it.
+    #The view itself doesn't commit: this does, together with the saved answer
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return _commit_if_ok(make_response(view(*args, **kwargs)))
+        if not key or len(key) > 255:
+            return {
+                'status': 400,
+                'message': 'Idempotency-Key must be 1 to 255 characters'
+            }, 400
+
+        fingerprint = _fingerprint()
+        deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT_SECONDS']
+        while True:
+            state, value = _claim(key, fingerprint)
+            if state == 'claimed':
+                break
+            if state == 'answered':
+                return value
+            if state == 'running':
+                if time.monotonic() >= deadline:
+                    return {
+                        'status': 409,
+                        'message': 'A request with this Idempotency-Key is still being processed. Please try again shortly'
+                    }, 409
+                _wait(key, deadline)
+            #'free': it was just given back or had expired, try to claim it again straight away
+
+        with _running_lock:
+            done = _running[key] = threading.Event()
+        try:
+            return _run(key, value, view, args, kwargs)
+        finally:
+            with _running_lock:
+                _running.pop(key, None)
+            done.set()
+    return wrapper
+
+
+def _fingerprint():
+    #who sent what: the same key from another client or with a different body is a mistake, not a retry
+    digest = hashlib.sha256()
+    for part in (request.method, request.path, str(get_jwt_identity())):
+        digest.update(part.encode() + b'\0')
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _claim(key, fingerprint):
+    now = datetime.utcnow()
+    row = IdempotencyKey(key, fingerprint, now + timedelta(seconds = current_app.config['IDEMPOTENCY_LEASE_SECONDS']))
+    owner = row.owner
+    db.session.add(row)
+    try:
+        db.session.commit() #committed on its own so every other worker can see the key is taken
+        return 'claimed', owner
+    except IntegrityError:
+        db.session.rollback()
+
+    existing = db.session.execute(
+        db.select(IdempotencyKey.fingerprint, IdempotencyKey.response_status, IdempotencyKey.response_body, IdempotencyKey.expires_at)
+        .where(IdempotencyKey.key == key)
+    ).first()
+    db.session.rollback() #don't sit in a transaction while we wait
+
+    if existing is None:
+        return 'free', None
+    if existing.expires_at <= now:
+        #an answer past its TTL, or a request whose worker died before finishing: take the key over
+        db.session.execute(db.delete(IdempotencyKey.__table__).where(IdempotencyKey.key == key, IdempotencyKey.expires_at <= now))
+        db.session.commit()
+        return 'free', None
+    if existing.fingerprint != fingerprint:
+        return 'answered', ({
+            'status': 422,
+            'message': 'This Idempotency-Key was already used for a different request'
+        }, 422)
+    if existing.response_status is None:
+        return 'running', None
+
+    response = current_app.response_class(existing.response_body, status = existing.response_status, mimetype = current_app.json.mimetype)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return 'answered', response
+
+
+def _wait(key, deadline):
+    with _running_lock:
+        running_here = _running.get(key)
+    if running_here is not None:
+        running_here.wait(max(0, deadline - time.monotonic())) #wakes the moment this worker's request finishes
+    else:
+        time.sleep(min(0.1, max(0, deadline - time.monotonic()))) #another worker has it, check the table again shortly
+
+
+def _run(key, owner, view, args, kwargs):
+    try:
+        response = make_response(view(*args, **kwargs))
+    except Exception:
+        db.session.rollback()
+        _release(key, owner)
+        raise
+
+    if not 200 <= response.status_code < 300:
+        #nothing was done so there's nothing to remember, the client can retry with the same key
+        db.session.rollback()
+        _release(key, owner)
+        return response
+
+    #save the answer in the same transaction as the order: both are committed or neither is
+    saved = db.session.execute(
+        db.update(IdempotencyKey.__table__)
+        .where(IdempotencyKey.key == key, IdempotencyKey.owner == owner)
+        .values(
+            response_status = response.status_code,
+            response_body = response.get_data(),
+            expires_at = datetime.utcnow() + timedelta(seconds = current_app.config['IDEMPOTENCY_KEY_SECONDS'])
+        )
+    )
+    if not saved.rowcount: #we ran past our lease & another request took the key over, so it gets to do the work
+        db.session.rollback()
+        return {
+            'status': 409,
+            'message': 'This request took too long and was taken over by a retry with the same Idempotency-Key'
+        }, 409
+
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _release(key, owner)
+        raise
+    return response
+
+
+def _release(key, owner):
+    db.session.execute(db.delete(IdempotencyKey.__table__).where(IdempotencyKey.key == key, IdempotencyKey.owner == owner))
+    db.session.commit()
+
+
+def _commit_if_ok(response):
+    #no Idempotency-Key: same transaction handling, just nothing to remember
+    if 200 <= response.status_code < 300:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return response
@@ -2,11 +2,17 @@ from werkzeug.security import generate_password_hash #allows us to generate a ha
 from flask_sqlalchemy import SQLAlchemy #allows our database to read our classes/objects as tables/rows 
 from flask_login import UserMixin, LoginManager #allows us to load a current logged in user
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import functools
+import operator
 import uuid #generate a unique id (basically the same serializing last week)
 from flask_marshmallow import Marshmallow
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 
 #internal imports
-from .helpers import get_image
+from .helpers import new_id, LRUCache
+
 
 
 
@@ -14,17 +20,64 @@ db = SQLAlchemy() #instantiate our database
 login_manager = LoginManager() #instantiate our login manager
 ma = Marshmallow() #instantiating our Marshmellow class
 
+PLACEHOLDER_IMAGE = '/static/images/car_placeholder.svg' #what a car shows until the image workers find the real one
+
+
+
+class UUIDKey(db.TypeDecorator):
+
+    """
+    Primary/foreign key column for our generated ids.
+    Python always sees the usual 36 character string,
+    the database stores a native uuid (Postgres) or 16 raw bytes (everything else)
+    instead of 36 characters of text, which keeps every key & index less than half the size.
+    """
+
+    impl = db.LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(db.Uuid(as_uuid = True))
+        return dialect.type_descriptor(db.LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            value = value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+        except ValueError:
+            return None #not a valid id (e.g. garbage in a url), so it can't match any row
+        return value if dialect.name == 'postgresql' else value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            value = uuid.UUID(bytes = value)
+        return str(value)
+
 
 
+#detached copies of recently loaded users so an authenticated page view doesn't cost a query every time.
+#Short TTL, and cache.py clears it whenever a user row changes (in any worker)
+user_cache = LRUCache(max_entries = 1024, ttl = 60)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id) #this queries our database & brings back the user with the same id
+    user = user_cache.get(user_id)
+    if user is None:
+        user = User.query.get(user_id) #this queries our database & brings back the user with the same id
+        if user is not None:
+            db.session.expunge(user) #detach it so it can outlive this request's session
+            user_cache.set(user_id, user)
+    return user
 
 
 
 class User(db.Model, UserMixin):
     #think of this part as the CREATE TABLE 'User' 
-    user_id = db.Column(db.String, primary_key = True)
+    user_id = db.Column(UUIDKey, primary_key = True)
     first_name = db.Column(db.String(30))
     last_name = db.Column(db.String(30))
     username = db.Column(db.String(30), nullable=False, unique=True)
@@ -43,7 +96,7 @@ class User(db.Model, UserMixin):
 
 
     def set_id(self):
-        return str(uuid.uuid4())
+        return new_id()
     
     def get_id(self):
         return str(self.user_id)
@@ -57,7 +110,7 @@ class User(db.Model, UserMixin):
         return f"<USER: {self.username}>"
 
 class Car(db.Model):
-    car_id = db.Column(db.String, primary_key = True)
+    car_id = db.Column(UUIDKey, primary_key = True)
     make = db.Column(db.String(25), nullable = False)
     model = db.Column(db.String(25), nullable = False)
     color = db.Column(db.String(25), nullable = False)
@@ -65,10 +118,24 @@ class Car(db.Model):
     image = db.Column(db.String, nullable = False)
     description = db.Column(db.String(200))
     price = db.Column(db.Numeric(precision=10, scale=2), nullable = False)
-    quantity = db.Column(db.Integer, nullable = False)
+    quantity = db.column_property(db.Column(db.Integer, nullable = False), active_history = True) #active_history keeps the old value around so shop_stats knows how much it changed
     date_added = db.Column(db.DateTime, default = datetime.utcnow)
+    version_id = db.Column(db.Integer, nullable = False, server_default = '1') #optimistic locking, see __mapper_args__
+    image_lookup = db.relationship('ImageLookup', backref = 'car', lazy = True, cascade = 'all, delete-orphan') #deleting a car drops its pending image lookup too
     #user_id = db.Column(db.String, db.ForeignKey('user.user_id'), nullable = False) #if we wanted to make a foreign key relationship
 
+    __table_args__ = (
+        db.Index('ix_car_date_added_car_id', 'date_added', 'car_id'), #keyset pagination on /api/shop walks this index
+        #the ?make=&model=, ?color=, ?year= & ?min_price=/max_price= filters on /api/shop, the (x, car_id) ones also serve ?sort=x pages
+        db.Index('ix_car_make_model', 'make', 'model'),
+        db.Index('ix_car_color', 'color'),
+        db.Index('ix_car_year_car_id', 'year', 'car_id'),
+        db.Index('ix_car_price_car_id', 'price', 'car_id'),
+    )
+    #every UPDATE/DELETE checks the row still has the version_id we read & bumps it,
+    #so if someone else changed the car since we loaded it the flush raises StaleDataError instead of overwriting their change
+    __mapper_args__ = {'version_id_col': version_id}
+
     def __init__(self, make, model, year, color, price, quantity, image = '', description = ''):
         self.car_id = self.set_id()
         self.make = make
@@ -81,11 +148,14 @@ class Car(db.Model):
         self.description = description
 
     def set_id(self):
-        return str(uuid.uuid4()) #create unique ID
+        return new_id() #create unique, time ordered ID
     
     def set_image(self, image, model, make, year, color):
         if not image: 
-            image = get_image(color+year+make+model) #adding get_image function which makes an external API call
+            #the image search is an external API call, so instead of waiting on it here we queue it up
+            #& the workers in enrichment.py swap the placeholder for the real image once it comes back
+            image = PLACEHOLDER_IMAGE
+            self.image_lookup.append(ImageLookup(color+year+make+model))
 
         return image
     
@@ -96,11 +166,87 @@ class Car(db.Model):
     def increment_quantity(self, quantity):
         self.quantity += int(quantity)
         return self.quantity
+
+    @classmethod
+    def decrement_stock(cls, lines):
+        #lines is {car_id: quantity}. One UPDATE sent as an executemany; the WHERE only matches if there is enough stock,
+        #so the database does the check & the subtraction together and two workers can never oversell the same car
+        stmt = (
+            db.update(cls.__table__)
+            .where(cls.car_id == db.bindparam('line_car_id'), cls.quantity >= db.bindparam('line_quantity'))
+            .values(quantity = cls.quantity - db.bindparam('line_quantity'), version_id = cls.version_id + 1) #so anyone holding the old quantity gets a conflict
+        )
+        #rows are locked in the order they're updated, so always go by car_id: two orders for {A, B} & {B, A}
+        #would otherwise each hold one car while waiting on the other (a deadlock on Postgres)
+        result = db.session.execute(stmt, [{'line_car_id': car_id, 'line_quantity': quantity} for car_id, quantity in sorted(lines.items())])
+
+        if result.rowcount != len(lines):
+            return False #at least one line couldn't be filled & the caller should roll back
+
+        #this UPDATE skips the ORM so the flush listeners never see it
+        ShopStats.bump(db.session.connection(), units_in_stock = -sum(lines.values()))
+        CacheVersion.bump(db.session, CacheVersion.INVENTORY)
+        return True
+
+    @classmethod
+    def stock_shortfalls(cls, lines):
+        #run after a rollback to tell the customer which lines we couldn't fill
+        in_stock = dict(db.session.query(cls.car_id, cls.quantity).filter(cls.car_id.in_(lines)).all())
+
+        return [
+            {'car_id': car_id, 'requested': quantity, 'available': in_stock.get(car_id, 0)}
+            for car_id, quantity in lines.items()
+            if in_stock.get(car_id, 0) < quantity
+        ]
     
+    @classmethod
+    def search(cls, terms, limit):
+        #full text search over make/model/color/year/description, best match first (index built in the car_search migration).
+        #every term has to match as a prefix, so 'red 2019 civ' already finds the red 2019 Civic
+        if db.session.get_bind().dialect.name == 'postgresql':
+            #generated tsvector column with a GIN index, ranked by ts_rank
+            rows = db.session.execute(db.text(
+                "SELECT car_id FROM car WHERE search @@ to_tsquery('simple', :query) "
+                "ORDER BY ts_rank(search, to_tsquery('simple', :query)) DESC LIMIT :limit"
+            ), {'query': ' & '.join(f'{term}:*' for term in terms), 'limit': limit})
+            ids = [str(car_id) for car_id, in rows]
+        else:
+            #FTS5 table kept in sync by triggers, ranked by bm25 with make/model weighted above the rest
+            rows = db.session.execute(db.text(
+                "SELECT car_key FROM car_search WHERE car_search MATCH :query "
+                "ORDER BY bm25(car_search, 0, 10, 10, 5, 5, 1) LIMIT :limit"
+            ), {'query': '{make model color year description} : ' + ' '.join(f'"{term}"*' for term in terms), 'limit': limit})
+            ids = [str(uuid.UUID(car_key)) for car_key, in rows]
+
+        #then the cars themselves by primary key, put back in rank order
+        cars = {car.car_id: car for car in cls.query.filter(cls.car_id.in_(ids))}
+        return [cars[car_id] for car_id in ids if car_id in cars]
+
     def __repr__(self):
         return f'<Car: {self.model}>'
     
 
+class ImageLookup(db.Model):
+    #a durable queue of image searches, saved in the same transaction as the car so a restart never loses one
+    lookup_id = db.Column(UUIDKey, primary_key = True)
+    car_id = db.Column(UUIDKey, db.ForeignKey('car.car_id'), nullable = False)
+    search = db.Column(db.String, nullable = False)
+    attempts = db.Column(db.Integer, nullable = False, default = 0)
+    available_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow) #a worker claims a row by pushing this into the future
+    date_added = db.Column(db.DateTime, default = datetime.utcnow)
+
+    def __init__(self, search):
+        self.lookup_id = self.set_id()
+        self.search = search
+        self.attempts = 0
+
+    def set_id(self):
+        return new_id()
+
+    def __repr__(self):
+        return f'<IMAGE LOOKUP: {self.search}>'
+
+
 class Customer(db.Model):
     cust_id = db.Column(db.String, primary_key = True)
     date_created = db.Column(db.DateTime, default = datetime.utcnow) 
@@ -115,12 +261,20 @@ class Customer(db.Model):
 #So we need a join table
 
 class carOrder(db.Model):
-    car_order_id = db.Column(db.String, primary_key = True)
-    car_id = db.Column(db.String, db.ForeignKey('car.car_id'), nullable = False)
-    quantity = db.Column(db.Integer, nullable = False)
+    car_order_id = db.Column(UUIDKey, primary_key = True)
+    car_id = db.Column(UUIDKey, db.ForeignKey('car.car_id'), nullable = False)
+    quantity = db.column_property(db.Column(db.Integer, nullable = False), active_history = True)
     price = db.Column(db.Numeric(precision = 10, scale = 2), nullable = False)
-    order_id = db.Column(db.String, db.ForeignKey('order.order_id'), nullable = False)
+    order_id = db.Column(UUIDKey, db.ForeignKey('order.order_id'), nullable = False)
     cust_id = db.Column(db.String, db.ForeignKey('customer.cust_id'), nullable = False)
+    #lets get_order reach the car straight from a carOrder (car_order.car). Only this side: a collection on Car would have
+    #the ORM null out car_id on a car's order lines when the car is deleted, which car_id being NOT NULL doesn't allow
+    car = db.relationship('Car')
+
+    __table_args__ = (
+        db.Index('ix_car_order_cust_id', 'cust_id'), #get_order looks lines up by customer
+        db.Index('ix_car_order_order_id_car_id', 'order_id', 'car_id'), #update_order & delete_car_order look up one car on one order
+    )
     
     def __init__(self, car_id, quantity, price, order_id, cust_id):
         self.car_order_id = self.set_id()
@@ -132,49 +286,252 @@ class carOrder(db.Model):
 
 
     def set_id(self):
-        return str(uuid.uuid4())
+        return new_id()
     
     def set_price(self, price, quantity):
-        quantity = float(quantity)
-        price = float(price)
-
-        self.price = quantity * price
+        self.price = Decimal(str(price)) * int(quantity)
         return self.price
     
     def update_quantity(self, quantity): #method used for when customers update their order quantity of a specific car
         self.quantity = int(quantity)
         return self.quantity 
 
+    @classmethod
+    def bulk_create(cls, order_id, cust_id, lines):
+        #skips building a carOrder object per line: every row goes to the database in one multi-row INSERT,
+        #which matters for fleet orders with hundreds of lines. Returns the order total for all the lines
+        rows = [
+            {
+                'car_order_id': new_id(),
+                'car_id': line['car_id'],
+                'quantity': int(line['quantity']),
+                'price': (Decimal(str(line['price'])) * int(line['quantity'])).quantize(Decimal('0.01')),
+                'order_id': order_id,
+                'cust_id': cust_id
+            }
+            for line in lines
+        ]
+        db.session.execute(db.insert(cls), rows)
+        ShopStats.bump(db.session.connection(), units_sold = sum(row['quantity'] for row in rows)) #bulk inserts skip track_shop_stats too
+
+        return sum((row['price'] for row in rows), Decimal('0.00'))
+
 
 class Order(db.Model):
-    order_id = db.Column(db.String, primary_key = True)
-    order_total = db.Column(db.Numeric(precision = 10, scale = 2), nullable = False)
+    order_id = db.Column(UUIDKey, primary_key = True)
+    order_total = db.column_property(db.Column(db.Numeric(precision = 10, scale = 2), nullable = False), active_history = True)
     date_created = db.Column(db.DateTime, default = datetime.utcnow())
+    version_id = db.Column(db.Integer, nullable = False, server_default = '1')
     preorder = db.relationship('carOrder', backref = 'order', lazy = True)
 
+    __mapper_args__ = {'version_id_col': version_id} #same optimistic locking as Car, for order_total
+
     def __init__(self):
         self.order_id = self.set_id()
         self.order_total = 0.00
 
     def set_id(self):
-        return str(uuid.uuid4())
+        return new_id()
     
     #for every car's total price in carorder table add to our order's total price
     def increment_order_total(self, price):
-        self.order_total = float(self.order_total)
-        self.order_total += float(price)
+        self.order_total = Decimal(str(self.order_total)) + Decimal(str(price))
 
         return self.order_total
     
     def decrement_order_total(self, price):
-        self.order_total = float(self.order_total)
-        self.order_total -= float(price)
+        self.order_total = Decimal(str(self.order_total)) - Decimal(str(price))
 
         return self.order_total
     
     def __repr__(self):
         return f'<ORDER: {self.order_id}>'
 
+class ShopStats(db.Model):
+    #one row of running totals for the home page banner (and any future dashboard)
+    #kept up to date by track_shop_stats below, rebuilt from scratch with `flask shop-stats rebuild`
+    stats_id = db.Column(db.Integer, primary_key = True)
+    cars = db.Column(db.Integer, nullable = False, default = 0)
+    units_in_stock = db.Column(db.Integer, nullable = False, default = 0)
+    customers = db.Column(db.Integer, nullable = False, default = 0)
+    orders = db.Column(db.Integer, nullable = False, default = 0)
+    units_sold = db.Column(db.Integer, nullable = False, default = 0)
+    gross_sales = db.Column(db.Numeric(precision = 12, scale = 2), nullable = False, default = 0)
+
+    ROW_ID = 1 #there is only ever one row
+    FIELDS = ['cars', 'units_in_stock', 'customers', 'orders', 'units_sold', 'gross_sales']
+
+    def __init__(self, **totals):
+        self.stats_id = self.ROW_ID
+        for field in self.FIELDS:
+            setattr(self, field, totals.get(field, 0))
+
+    @classmethod
+    def current(cls):
+        #the maintained row, or a fresh count if nobody has built it yet
+        return db.session.get(cls, cls.ROW_ID) or cls.compute()
+
+    @classmethod
+    def compute(cls):
+        #the slow way: aggregate every table. Returns an unsaved ShopStats
+        totals = db.session.execute(db.select(
+            db.select(db.func.count()).select_from(Car).scalar_subquery(),
+            db.select(db.func.coalesce(db.func.sum(Car.quantity), 0)).scalar_subquery(),
+            db.select(db.func.count()).select_from(Customer).scalar_subquery(),
+            db.select(db.func.count()).select_from(Order).scalar_subquery(),
+            db.select(db.func.coalesce(db.func.sum(carOrder.quantity), 0)).scalar_subquery(),
+            db.select(db.func.coalesce(db.func.sum(Order.order_total), 0)).scalar_subquery()
+        )).one()
+
+        return cls(**dict(zip(cls.FIELDS, totals)))
+
+    @classmethod
+    def rebuild(cls):
+        #recount everything & overwrite the row. Returns {field: (was, now)} for every field that had drifted
+        fresh = cls.compute()
+        row = db.session.get(cls, cls.ROW_ID)
+        if row is None:
+            row = cls()
+            db.session.add(row)
+
+        drift = row.drift(fresh)
+        for field in cls.FIELDS:
+            setattr(row, field, getattr(fresh, field))
+        return drift
+
+    def drift(self, other):
+        return {
+            field: (getattr(self, field), getattr(other, field))
+            for field in self.FIELDS
+            if Decimal(str(getattr(self, field))) != Decimal(str(getattr(other, field)))
+        }
+
+    @classmethod
+    def bump(cls, connection, **deltas):
+        #col = col + delta happens inside the database, so two workers bumping at once can't lose an update
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if deltas:
+            connection.execute(
+                db.update(cls.__table__)
+                .where(cls.stats_id == cls.ROW_ID)
+                .values({field: getattr(cls, field) + delta for field, delta in deltas.items()})
+            )
+
+    def __repr__(self):
+        return f'<SHOP STATS: {self.cars} cars, {self.orders} orders>'
+
+
+def _history_delta(obj, attr):
+    #how much a numeric attribute changed in this flush (new value minus old value)
+    history = inspect(obj).attrs[attr].history
+    added = sum(Decimal(str(value)) for value in history.added if value is not None)
+    removed = sum(Decimal(str(value)) for value in history.deleted if value is not None)
+    return added - removed
+
+@event.listens_for(Session, 'after_flush')
+def track_shop_stats(session, flush_context):
+    #runs after every flush (the new/dirty/deleted lists & attribute history still describe it): turn the inserts/updates/deletes
+    #into deltas on the shop_stats row. Bulk statements skip the ORM (Car.decrement_stock, carOrder.bulk_create) so their callers bump the row themselves.
+    #After, not before: the flush has already written (and locked) the car rows, so every path locks car -> shop_stats -> cache_version
+    #in the same order as decrement_stock does & two transactions can't deadlock waiting on each other's hot rows
+    deltas = dict.fromkeys(ShopStats.FIELDS, 0)
+
+    for obj, sign in [(obj, 1) for obj in session.new] + [(obj, -1) for obj in session.deleted]:
+        if isinstance(obj, Car):
+            deltas['cars'] += sign
+            deltas['units_in_stock'] += sign * (obj.quantity or 0)
+        elif isinstance(obj, Customer):
+            deltas['customers'] += sign
+        elif isinstance(obj, Order):
+            deltas['orders'] += sign
+            deltas['gross_sales'] += sign * Decimal(str(obj.order_total or 0))
+        elif isinstance(obj, carOrder):
+            deltas['units_sold'] += sign * (obj.quantity or 0)
+
+    for obj in session.dirty:
+        if isinstance(obj, Car):
+            deltas['units_in_stock'] += _history_delta(obj, 'quantity')
+        elif isinstance(obj, Order):
+            deltas['gross_sales'] += _history_delta(obj, 'order_total')
+        elif isinstance(obj, carOrder):
+            deltas['units_sold'] += _history_delta(obj, 'quantity')
+
+    if any(deltas.values()):
+        ShopStats.bump(session.connection(), **deltas)
+
+class CacheVersion(db.Model):
+    #named counters that go up every time the data behind a cache changes, e.g. 'inventory' for the car table.
+    #Anything cached or handed out as an ETag remembers the version it was built from
+    name = db.Column(db.String(50), primary_key = True)
+    version = db.Column(db.Integer, nullable = False, default = 0)
+
+    INVENTORY = 'inventory'
+    USERS = 'users'
+
+    def __init__(self, name, version = 0):
+        self.name = name
+        self.version = version
+
+    @classmethod
+    def get(cls, name):
+        return db.session.execute(db.select(cls.version).where(cls.name == name)).scalar() or 0
+
+    @classmethod
+    def bump(cls, session, name):
+        connection = session.connection()
+        version = connection.execute(db.update(cls.__table__).where(cls.name == name).values(version = cls.version + 1).returning(cls.version)).scalar()
+        if version is None: #first bump for this name
+            connection.execute(db.insert(cls.__table__).values(name = name, version = 1))
+            version = 1
+
+        #remembered until the transaction ends so cache.py can drop stale entries once it commits,
+        #as (the version this transaction started from, the version it leaves behind)
+        bumped = session.info.setdefault('bumped_versions', {})
+        bumped[name] = (bumped.get(name, (version - 1,))[0], version)
+
+    def __repr__(self):
+        return f'<CACHE VERSION: {self.name} v{self.version}>'
+
+
+class IdempotencyKey(db.Model):
+    #what we answered for a client's Idempotency-Key, so a retried POST gets the same answer instead of running twice (see idempotency.py)
+    key = db.Column(db.String(255), primary_key = True)
+    fingerprint = db.Column(db.String(64), nullable = False) #sha256 of who sent what, the same key with a different request is refused
+    owner = db.Column(db.String(36), nullable = False) #the claim running it, so a request whose lease ran out can't save over whoever took over
+    response_status = db.Column(db.Integer) #null while the first request is still running
+    response_body = db.Column(db.LargeBinary)
+    expires_at = db.Column(db.DateTime, nullable = False) #the lease while running, then how long the answer is kept
+    date_created = db.Column(db.DateTime, default = datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_idempotency_key_expires_at', 'expires_at'), #for purging old keys
+    )
+
+    def __init__(self, key, fingerprint, expires_at):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.owner = new_id()
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return f'<IDEMPOTENCY KEY: {self.key}>'
+
+
+@event.listens_for(Session, 'after_flush')
+def track_cache_versions(session, flush_context):
+    #a car added, changed or removed means a new inventory version, same for users
+    #(Car.decrement_stock skips the ORM & bumps the inventory itself). After the flush for the same lock order as track_shop_stats
+    changed = set()
+    for obj in session.new | session.deleted | session.dirty:
+        name = VERSIONED_MODELS.get(type(obj))
+        if name and (obj not in session.dirty or session.is_modified(obj)):
+            changed.add(name)
+
+    for name in sorted(changed):
+        CacheVersion.bump(session, name)
+
+VERSIONED_MODELS = {Car: CacheVersion.INVENTORY, User: CacheVersion.USERS}
+
 #Because we are building a RESTful API this week (Representational State Transfer)
 #json rules that world.  JavaScript Object Notation aka dictionaries
 
@@ -188,4 +545,91 @@ class carSchema(ma.Schema):
 
 
 car_schema = carSchema() # this is for passing 1 singular car
-cars_schema = carSchema(many = True) # this is for passing mulitple cars, list of dictionaries
\ No newline at end of file
+cars_schema = carSchema(many = True) # this is for passing mulitple cars, list of dictionaries
+
+
+def car_fields(requested):
+    #turns ?fields=price,car_id into ('car_id', 'price'): only real carSchema fields, always in schema order
+    #raises ValueError naming anything we don't know about
+    requested = [field.strip() for field in requested.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in carSchema.Meta.fields]
+    if unknown or not requested:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown) or '(none given)'}")
+    return tuple(field for field in carSchema.Meta.fields if field in requested)
+
+#what ?sort= can be on /api/shop (with a leading - for descending) & how to read its value back out of a cursor,
+#only columns with a (column, car_id) index so every page is still a range scan
+CAR_SORTS = {
+    'date_added': datetime.fromisoformat,
+    'price': Decimal,
+    'year': str,
+}
+
+def car_sort(requested):
+    #turns ?sort=-price into (Car.price, True), raises ValueError for anything not in CAR_SORTS
+    name = requested.lstrip('-')
+    if name not in CAR_SORTS:
+        raise ValueError(f"Unknown sort: {name}. Use one of {', '.join(CAR_SORTS)}")
+    return getattr(Car, name), requested.startswith('-')
+
+CAR_MATCH_FILTERS = ['make', 'model', 'color', 'year'] #?make=Honda
+CAR_RANGE_FILTERS = {'price': Decimal, 'quantity': int} #?min_price=10000&max_price=20000
+
+def car_filters(args):
+    #turns the filter query parameters into WHERE clauses, raises ValueError for a range that isn't a number
+    clauses = [getattr(Car, field) == args[field] for field in CAR_MATCH_FILTERS if args.get(field)]
+
+    for field, parse in CAR_RANGE_FILTERS.items():
+        for bound, compare in (('min', operator.ge), ('max', operator.le)):
+            name = f'{bound}_{field}'
+            if not args.get(name):
+                continue
+            try:
+                value = parse(args[name])
+            except (ValueError, InvalidOperation):
+                raise ValueError(f'{name} must be a number')
+            if isinstance(value, Decimal) and not value.is_finite():
+                raise ValueError(f'{name} must be a number')
+            clauses.append(compare(getattr(Car, field), value))
+
+    return clauses
+
+PRICE_BANDS = [10000, 20000, 30000, 50000] #edges of the price facet: 0-10000, 10000-20000, ... 50000+
+
+def car_facets(filters):
+    #counts per make, color, decade & price band for the cars matching filters, all from one grouped query:
+    #GROUPING SETS on Postgres, a UNION ALL of one GROUP BY per facet elsewhere
+    edges = [0] + PRICE_BANDS
+    band = db.case(
+        *[(Car.price < high, f'{low}-{high}') for low, high in zip(edges, edges[1:])],
+        else_ = f'{edges[-1]}+'
+    )
+    cars = db.select(
+        Car.make,
+        Car.color,
+        (db.func.substr(Car.year, 1, 3) + '0s').label('decade'), #'2019' -> '2010s'
+        band.label('price'),
+    ).where(*filters).subquery()
+    names = ['make', 'color', 'decade', 'price']
+
+    facets = {name: {} for name in names}
+    if db.session.get_bind().dialect.name == 'postgresql':
+        columns = [cars.c[name] for name in names]
+        rows = db.session.execute(db.select(*columns, db.func.count()).group_by(db.func.grouping_sets(*[db.tuple_(column) for column in columns])))
+        for *values, count in rows:
+            name, value = next((name, value) for name, value in zip(names, values) if value is not None) #the one set this row was grouped by
+            facets[name][value] = count
+    else:
+        rows = db.session.execute(db.union_all(*[
+            db.select(db.literal(name).label('facet'), cars.c[name].label('value'), db.func.count()).group_by(cars.c[name])
+            for name in names
+        ]))
+        for name, value, count in rows:
+            facets[name][value] = count
+
+    return facets
+
+@functools.lru_cache(maxsize = 64)
+def cars_schema_for(fields):
+    #a many=True carSchema that only dumps some fields, built once per field combination
+    return carSchema(many = True, only = fields)
\ No newline at end of file
@@ -0,0 +1,121 @@
+import bisect
+import heapq
+import threading
+from collections import Counter
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+#internal imports
+from .models import Car, CacheVersion, db
+from .cache import bus
+
+
+
+class Suggestions():
+
+    """
+    Prefix autocomplete for the storefront search box, answered from memory.
+    Every distinct make, model & color sits in one sorted list of (lowercased value, field, value),
+    so a prefix is two bisects & a slice, and each value keeps how many cars have it so the common ones come first.
+    Built from the car table on the first request, then kept up to date from this worker's own commits;
+    a change made by another worker (heard through the invalidation bus) just means rebuilding on the next request.
+    """
+
+    FIELDS = ['make', 'model', 'color']
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = None #sorted (key, field, value), None until built & again whenever it can't be trusted
+        self.counts = Counter() #(field, value) -> how many cars have it
+
+    def suggest(self, prefix, limit = 10):
+        prefix = prefix.lower()
+        with self.lock:
+            if self.entries is None:
+                self.build()
+            start = bisect.bisect_left(self.entries, (prefix,))
+            end = bisect.bisect_left(self.entries, (prefix + '\U0010ffff',))
+            best = heapq.nlargest(limit, self.entries[start:end], key = lambda entry: self.counts[entry[1:]])
+            return [{'field': field, 'value': value, 'count': self.counts[(field, value)]} for _, field, value in best]
+
+    def build(self):
+        counts = Counter()
+        for field in self.FIELDS:
+            column = getattr(Car, field)
+            for value, count in db.session.query(column, db.func.count()).group_by(column):
+                counts[(field, value)] = count
+
+        self.counts = counts
+        self.entries = sorted((value.lower(), field, value) for field, value in counts)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries = None
+
+    def apply(self, deltas):
+        #a committed transaction's {(field, value): +/- cars}
+        with self.lock:
+            if self.entries is None: #not built yet (or already stale), the next build reads it from the table anyway
+                return
+            for (field, value), delta in deltas.items():
+                if not delta:
+                    continue
+                before = self.counts[(field, value)]
+                self.counts[(field, value)] += delta
+                entry = (value.lower(), field, value)
+                if before <= 0 < self.counts[(field, value)]:
+                    bisect.insort(self.entries, entry)
+                elif before > 0 >= self.counts[(field, value)]:
+                    del self.entries[bisect.bisect_left(self.entries, entry)]
+                    del self.counts[(field, value)]
+
+
+suggestions = Suggestions()
+#this worker's own writes come through apply, so only other workers' car changes mean starting over
+bus.subscribe(CacheVersion.INVENTORY, suggestions.invalidate, local = False)
+
+
+def _stored_value(car, field):
+    #what the row holds in the database right now, or None if this session never loaded it
+    history = inspect(car).attrs[field].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return None
+
+@event.listens_for(Session, 'before_flush')
+def track_suggestions(session, flush_context, instances):
+    #count what each flush adds & removes, applied once (and only if) the transaction commits
+    deltas = session.info.setdefault('suggestion_deltas', Counter())
+    for car in session.new | session.deleted | session.dirty:
+        if not isinstance(car, Car):
+            continue
+        for field in Suggestions.FIELDS:
+            if car in session.new:
+                deltas[(field, getattr(car, field))] += 1
+                continue
+
+            if car in session.dirty and not inspect(car).attrs[field].history.has_changes():
+                continue
+            stored = _stored_value(car, field)
+            if stored is None: #changed or deleted without ever being loaded, no way to know what to take away
+                session.info['suggestions_unknown'] = True
+                continue
+            deltas[(field, stored)] -= 1
+            if car not in session.deleted:
+                deltas[(field, getattr(car, field))] += 1
+
+@event.listens_for(Session, 'after_commit')
+def apply_suggestions(session):
+    deltas = session.info.pop('suggestion_deltas', None)
+    if session.info.pop('suggestions_unknown', False):
+        suggestions.invalidate()
+    elif deltas:
+        suggestions.apply(deltas)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_suggestions(session):
+    session.info.pop('suggestion_deltas', None)
+    session.info.pop('suggestions_unknown', None)
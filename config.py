@@ -26,4 +26,23 @@ class Config():
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False #hide update messages 
     JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY")
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=365)
\ No newline at end of file
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=365)
+    SHOP_PAGE_SIZE = int(os.environ.get('SHOP_PAGE_SIZE', 50)) #how many cars /api/shop returns when the client doesn't ask for a limit
+    SHOP_MAX_PAGE_SIZE = int(os.environ.get('SHOP_MAX_PAGE_SIZE', 200)) #upper bound on ?limit= so nobody can ask for the whole table
+    IMAGE_SEARCH_URL = os.environ.get('IMAGE_SEARCH_URL') or 'https://google-search72.p.rapidapi.com/imagesearch'
+    IMAGE_SEARCH_KEY = os.environ.get('RAPIDAPI_KEY') or 'ea104aa93amsh4d59e1dddb29571p11bd0djsn261ad6148142'
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2)) #threads filling in car images in the background, 0 turns the workers off
+    IMAGE_LOOKUP_MAX_ATTEMPTS = int(os.environ.get('IMAGE_LOOKUP_MAX_ATTEMPTS', 5)) #after this many tries the car just keeps the placeholder
+    IMAGE_LOOKUP_POLL_SECONDS = int(os.environ.get('IMAGE_LOOKUP_POLL_SECONDS', 30)) #how often the queue is swept for retries & lookups left behind by a restart
+    CATALOG_CACHE_ENTRIES = int(os.environ.get('CATALOG_CACHE_ENTRIES', 256)) #cached catalog responses kept per worker
+    CATALOG_CACHE_BYTES = int(os.environ.get('CATALOG_CACHE_BYTES', 32 * 1024 * 1024)) #and the most memory they're allowed to use
+    INVALIDATION_POLL_SECONDS = float(os.environ.get('INVALIDATION_POLL_SECONDS', 2)) #longest a worker can keep serving a cache another worker has invalidated
+    USER_CACHE_SECONDS = int(os.environ.get('USER_CACHE_SECONDS', 60)) #how long a logged in user is trusted without checking the database again
+    USER_CACHE_ENTRIES = int(os.environ.get('USER_CACHE_ENTRIES', 1024))
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500)) #rows fetched & written per chunk by /api/shop/export
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024)) #API responses smaller than this aren't worth compressing
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+    CONFLICT_RETRIES = int(os.environ.get('CONFLICT_RETRIES', 3)) #times an API write is rerun after losing an optimistic locking race before answering 409
+    IDEMPOTENCY_KEY_SECONDS = int(os.environ.get('IDEMPOTENCY_KEY_SECONDS', 86400)) #how long a finished request's answer is replayed for its Idempotency-Key
+    IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 60)) #after this a request that never finished (worker died) can be run again
+    IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 10)) #how long a duplicate waits for the first one before giving up with 409
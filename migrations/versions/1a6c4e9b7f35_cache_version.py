@@ -0,0 +1,29 @@
+"""cache version counters
+
+Revision ID: 1a6c4e9b7f35
+Revises: e5b93d2f08c4
+Create Date: 2026-10-18 10:52:40.284519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a6c4e9b7f35'
+down_revision = 'e5b93d2f08c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    cache_version = op.create_table('cache_version',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(cache_version, [{'name': 'inventory', 'version': 1}])
+
+
+def downgrade():
+    op.drop_table('cache_version')
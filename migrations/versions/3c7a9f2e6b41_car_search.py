@@ -0,0 +1,60 @@
+"""car full text search
+
+Revision ID: 3c7a9f2e6b41
+Revises: 8f4d1b6e2a57
+Create Date: 2026-10-18 11:47:26.905134
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7a9f2e6b41'
+down_revision = '8f4d1b6e2a57'
+branch_labels = None
+depends_on = None
+
+
+#SQLite: an FTS5 table holding each car's text, keyed by the car_id in hex.
+#car has no INTEGER PRIMARY KEY, so its rowids can change on VACUUM & can't be used to point back at the car.
+#car_key is an indexed column so the triggers can find a car's entry with a MATCH instead of a scan
+SQLITE_KEY = "lower(hex({row}.car_id))"
+SQLITE_INSERT = (
+    "INSERT INTO car_search (car_key, make, model, color, year, description) "
+    "VALUES (" + SQLITE_KEY.format(row='new') + ", new.make, new.model, new.color, new.year, coalesce(new.description, ''));"
+)
+SQLITE_DELETE = "DELETE FROM car_search WHERE car_search MATCH 'car_key:\"' || " + SQLITE_KEY.format(row='old') + " || '\"';"
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE car_search USING fts5(car_key, make, model, color, year, description, prefix='2 3')",
+    "INSERT INTO car_search (car_key, make, model, color, year, description) "
+    "SELECT lower(hex(car_id)), make, model, color, year, coalesce(description, '') FROM car",
+    f"CREATE TRIGGER car_search_insert AFTER INSERT ON car BEGIN {SQLITE_INSERT} END",
+    f"CREATE TRIGGER car_search_delete AFTER DELETE ON car BEGIN {SQLITE_DELETE} END",
+    #only the searchable columns, stock & price changes on every order shouldn't touch the index
+    f"CREATE TRIGGER car_search_update AFTER UPDATE OF car_id, make, model, color, year, description ON car BEGIN {SQLITE_DELETE} {SQLITE_INSERT} END",
+]
+
+#Postgres: a generated tsvector column the database keeps up to date itself, with a GIN index
+POSTGRES_UPGRADE = [
+    "ALTER TABLE car ADD COLUMN search tsvector GENERATED ALWAYS AS "
+    "(to_tsvector('simple', make || ' ' || model || ' ' || color || ' ' || year || ' ' || coalesce(description, ''))) STORED",
+    "CREATE INDEX ix_car_search ON car USING gin (search)",
+]
+
+
+def upgrade():
+    statements = POSTGRES_UPGRADE if op.get_bind().dialect.name == 'postgresql' else SQLITE_UPGRADE
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX ix_car_search')
+        op.execute('ALTER TABLE car DROP COLUMN search')
+    else:
+        for trigger in ['car_search_update', 'car_search_delete', 'car_search_insert']:
+            op.execute(f'DROP TRIGGER {trigger}')
+        op.execute('DROP TABLE car_search')
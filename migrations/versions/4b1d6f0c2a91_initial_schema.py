@@ -0,0 +1,79 @@
+"""initial schema
+
+Revision ID: 4b1d6f0c2a91
+Revises: 
+Create Date: 2026-10-18 10:02:11.416027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1d6f0c2a91'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+#the tables as they were before we started keeping migrations.
+#Databases that already have them only need `flask db stamp 4b1d6f0c2a91` before their first `flask db upgrade`
+
+
+def upgrade():
+    op.create_table('car',
+    sa.Column('car_id', sa.String(), nullable=False),
+    sa.Column('make', sa.String(length=25), nullable=False),
+    sa.Column('model', sa.String(length=25), nullable=False),
+    sa.Column('color', sa.String(length=25), nullable=False),
+    sa.Column('year', sa.String(length=10), nullable=False),
+    sa.Column('image', sa.String(), nullable=False),
+    sa.Column('description', sa.String(length=200), nullable=True),
+    sa.Column('price', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('date_added', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('car_id')
+    )
+    op.create_table('customer',
+    sa.Column('cust_id', sa.String(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('cust_id')
+    )
+    op.create_table('order',
+    sa.Column('order_id', sa.String(), nullable=False),
+    sa.Column('order_total', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('order_id')
+    )
+    op.create_table('user',
+    sa.Column('user_id', sa.String(), nullable=False),
+    sa.Column('first_name', sa.String(length=30), nullable=True),
+    sa.Column('last_name', sa.String(length=30), nullable=True),
+    sa.Column('username', sa.String(length=30), nullable=False),
+    sa.Column('email', sa.String(length=150), nullable=False),
+    sa.Column('password', sa.String(), nullable=False),
+    sa.Column('date_added', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('user_id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('car_order',
+    sa.Column('car_order_id', sa.String(), nullable=False),
+    sa.Column('car_id', sa.String(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('price', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('order_id', sa.String(), nullable=False),
+    sa.Column('cust_id', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['car_id'], ['car.car_id'], ),
+    sa.ForeignKeyConstraint(['cust_id'], ['customer.cust_id'], ),
+    sa.ForeignKeyConstraint(['order_id'], ['order.order_id'], ),
+    sa.PrimaryKeyConstraint('car_order_id')
+    )
+
+
+def downgrade():
+    op.drop_table('car_order')
+    op.drop_table('user')
+    op.drop_table('order')
+    op.drop_table('customer')
+    op.drop_table('car')
@@ -0,0 +1,25 @@
+"""seed users cache version
+
+Revision ID: 5d2e8a7c13f0
+Revises: 1a6c4e9b7f35
+Create Date: 2026-10-18 11:20:16.733051
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8a7c13f0'
+down_revision = '1a6c4e9b7f35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #the user_loader cache listens on this counter
+    op.execute("INSERT INTO cache_version (name, version) VALUES ('users', 1)")
+
+
+def downgrade():
+    op.execute("DELETE FROM cache_version WHERE name = 'users'")
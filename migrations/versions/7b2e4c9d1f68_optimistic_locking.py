@@ -0,0 +1,29 @@
+"""optimistic locking version columns
+
+Revision ID: 7b2e4c9d1f68
+Revises: 3c7a9f2e6b41
+Create Date: 2026-10-18 12:15:48.371920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2e4c9d1f68'
+down_revision = '3c7a9f2e6b41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #existing rows start at version 1, SQLAlchemy bumps it on every update from then on.
+    #Plain ALTERs rather than batch ops, a batch table copy on SQLite would also drop car's full text search triggers
+    op.add_column('car', sa.Column('version_id', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('order', sa.Column('version_id', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    #DROP COLUMN needs SQLite 3.35+
+    op.drop_column('order', 'version_id')
+    op.drop_column('car', 'version_id')
@@ -0,0 +1,33 @@
+"""car filter & sort indexes
+
+Revision ID: 8f4d1b6e2a57
+Revises: 5d2e8a7c13f0
+Create Date: 2026-10-18 11:24:13.640285
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f4d1b6e2a57'
+down_revision = '5d2e8a7c13f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #/api/shop filters on make/model, color, year & price ranges, and sorts by year or price with car_id as the tie breaker
+    with op.batch_alter_table('car', schema=None) as batch_op:
+        batch_op.create_index('ix_car_make_model', ['make', 'model'], unique=False)
+        batch_op.create_index('ix_car_color', ['color'], unique=False)
+        batch_op.create_index('ix_car_year_car_id', ['year', 'car_id'], unique=False)
+        batch_op.create_index('ix_car_price_car_id', ['price', 'car_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('car', schema=None) as batch_op:
+        batch_op.drop_index('ix_car_price_car_id')
+        batch_op.drop_index('ix_car_year_car_id')
+        batch_op.drop_index('ix_car_color')
+        batch_op.drop_index('ix_car_make_model')
@@ -0,0 +1,60 @@
+"""image lookup queue, shop stats & car keyset index
+
+Revision ID: 9e3a7c51d4b2
+Revises: 4b1d6f0c2a91
+Create Date: 2026-10-18 10:04:37.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3a7c51d4b2'
+down_revision = '4b1d6f0c2a91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('car', schema=None) as batch_op:
+        batch_op.create_index('ix_car_date_added_car_id', ['date_added', 'car_id'], unique=False)
+
+    op.create_table('image_lookup',
+    sa.Column('lookup_id', sa.String(), nullable=False),
+    sa.Column('car_id', sa.String(), nullable=False),
+    sa.Column('search', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('date_added', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['car_id'], ['car.car_id'], ),
+    sa.PrimaryKeyConstraint('lookup_id')
+    )
+    op.create_table('shop_stats',
+    sa.Column('stats_id', sa.Integer(), nullable=False),
+    sa.Column('cars', sa.Integer(), nullable=False),
+    sa.Column('units_in_stock', sa.Integer(), nullable=False),
+    sa.Column('customers', sa.Integer(), nullable=False),
+    sa.Column('orders', sa.Integer(), nullable=False),
+    sa.Column('units_sold', sa.Integer(), nullable=False),
+    sa.Column('gross_sales', sa.Numeric(precision=12, scale=2), nullable=False),
+    sa.PrimaryKeyConstraint('stats_id')
+    )
+
+    #seed the single stats row from whatever is already in the database
+    op.execute(
+        'INSERT INTO shop_stats (stats_id, cars, units_in_stock, customers, orders, units_sold, gross_sales) SELECT 1, '
+        '(SELECT COUNT(*) FROM car), '
+        '(SELECT COALESCE(SUM(quantity), 0) FROM car), '
+        '(SELECT COUNT(*) FROM customer), '
+        '(SELECT COUNT(*) FROM "order"), '
+        '(SELECT COALESCE(SUM(quantity), 0) FROM car_order), '
+        '(SELECT COALESCE(SUM(order_total), 0) FROM "order")'
+    )
+
+
+def downgrade():
+    op.drop_table('shop_stats')
+    op.drop_table('image_lookup')
+    with op.batch_alter_table('car', schema=None) as batch_op:
+        batch_op.drop_index('ix_car_date_added_car_id')
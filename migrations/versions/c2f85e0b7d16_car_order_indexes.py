@@ -0,0 +1,29 @@
+"""car_order indexes
+
+Revision ID: c2f85e0b7d16
+Revises: 9e3a7c51d4b2
+Create Date: 2026-10-18 10:06:52.357780
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f85e0b7d16'
+down_revision = '9e3a7c51d4b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #get_order filters on cust_id, update_order & delete_car_order on (order_id, car_id)
+    with op.batch_alter_table('car_order', schema=None) as batch_op:
+        batch_op.create_index('ix_car_order_cust_id', ['cust_id'], unique=False)
+        batch_op.create_index('ix_car_order_order_id_car_id', ['order_id', 'car_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('car_order', schema=None) as batch_op:
+        batch_op.drop_index('ix_car_order_order_id_car_id')
+        batch_op.drop_index('ix_car_order_cust_id')
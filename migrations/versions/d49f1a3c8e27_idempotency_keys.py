@@ -0,0 +1,38 @@
+"""idempotency keys
+
+Revision ID: d49f1a3c8e27
+Revises: 7b2e4c9d1f68
+Create Date: 2026-10-18 12:41:09.552806
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd49f1a3c8e27'
+down_revision = '7b2e4c9d1f68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('idempotency_key',
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('fingerprint', sa.String(length=64), nullable=False),
+    sa.Column('owner', sa.String(length=36), nullable=False),
+    sa.Column('response_status', sa.Integer(), nullable=True),
+    sa.Column('response_body', sa.LargeBinary(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('idempotency_key', schema=None) as batch_op:
+        batch_op.create_index('ix_idempotency_key_expires_at', ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('idempotency_key', schema=None) as batch_op:
+        batch_op.drop_index('ix_idempotency_key_expires_at')
+
+    op.drop_table('idempotency_key')
@@ -0,0 +1,84 @@
+"""compact uuid keys
+
+Revision ID: e5b93d2f08c4
+Revises: c2f85e0b7d16
+Create Date: 2026-10-18 10:31:05.118462
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import uuid
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b93d2f08c4'
+down_revision = 'c2f85e0b7d16'
+branch_labels = None
+depends_on = None
+
+
+#every generated key moves from 36 characters of text to a native uuid (Postgres) or 16 raw bytes (SQLite).
+#Existing uuid4 values keep their value, only how they're stored changes
+KEY_COLUMNS = {
+    'user': ['user_id'],
+    'car': ['car_id'],
+    'order': ['order_id'],
+    'car_order': ['car_order_id', 'car_id', 'order_id'],
+    'image_lookup': ['lookup_id', 'car_id'],
+}
+
+#Postgres won't change a key's type while a foreign key points at it, so these get dropped & put back
+FOREIGN_KEYS = [
+    ('car_order_car_id_fkey', 'car_order', 'car', 'car_id'),
+    ('car_order_order_id_fkey', 'car_order', 'order', 'order_id'),
+    ('image_lookup_car_id_fkey', 'image_lookup', 'car', 'car_id'),
+]
+
+
+def _rewrite_keys(convert):
+    #SQLite only: swap every stored key for its converted value, one UPDATE per column. The conversion runs inside SQLite
+    #as a function so it's a single pass over each table (car_order.car_id & image_lookup.car_id have no index to look values up by)
+    bind = op.get_bind()
+    bind.connection.driver_connection.create_function(
+        'convert_key', 1, lambda value: None if value is None else convert(value), deterministic=True
+    )
+    for table, columns in KEY_COLUMNS.items():
+        for column in columns:
+            bind.execute(sa.text(f'UPDATE "{table}" SET {column} = convert_key({column})'))
+
+
+def _alter_sqlite_columns(type_):
+    for table, columns in KEY_COLUMNS.items():
+        with op.batch_alter_table(table, schema=None, recreate='always') as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, type_=type_, existing_nullable=False)
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, table, _, _ in FOREIGN_KEYS:
+            op.drop_constraint(name, table, type_='foreignkey')
+        for table, columns in KEY_COLUMNS.items():
+            for column in columns:
+                op.execute(f'ALTER TABLE "{table}" ALTER COLUMN {column} TYPE uuid USING {column}::uuid')
+        for name, table, referent, column in FOREIGN_KEYS:
+            op.create_foreign_key(name, table, referent, [column], [column])
+    else:
+        #SQLite keeps whatever we store, so convert the values first & then change the declared types
+        #(the other way round the table copy would CAST the keys & mangle them)
+        _rewrite_keys(lambda value: value if isinstance(value, bytes) else uuid.UUID(value).bytes)
+        _alter_sqlite_columns(sa.LargeBinary(length=16))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, table, _, _ in FOREIGN_KEYS:
+            op.drop_constraint(name, table, type_='foreignkey')
+        for table, columns in KEY_COLUMNS.items():
+            for column in columns:
+                op.execute(f'ALTER TABLE "{table}" ALTER COLUMN {column} TYPE varchar USING {column}::text')
+        for name, table, referent, column in FOREIGN_KEYS:
+            op.create_foreign_key(name, table, referent, [column], [column])
+    else:
+        _rewrite_keys(lambda value: str(uuid.UUID(bytes=value)) if isinstance(value, bytes) else value)
+        _alter_sqlite_columns(sa.String())
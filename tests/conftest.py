@@ -0,0 +1,99 @@
+#pip install -r requirements-dev.txt, then from the project root: python -m pytest -q
+
+import importlib.util
+import os
+from pathlib import Path
+
+#an in-memory database & no background image workers, set before the app (and its Config) is imported
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['IMAGE_WORKERS'] = '0'
+
+import pytest
+from sqlalchemy import event
+
+import car_inventory.blueprints.api.routes as api_routes
+import car_inventory.cache as cache
+from car_inventory import app as flask_app
+from car_inventory.cache import bus, catalog_cache
+from car_inventory.models import db, user_cache, Car, Customer, Order, carOrder
+
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    bus.pid = os.getpid() #no invalidation poller thread, the in-memory database is a single shared connection
+    #every test starts again from inventory version 1, so nothing cached by an earlier test may survive
+    catalog_cache.clear()
+    user_cache.clear()
+
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(client):
+    access_token = client.post('/api/token', json={'client_id': 'tests'}).json['access_token']
+    return {'Authorization': f'Bearer {access_token}'}
+
+
+@pytest.fixture
+def statements(app):
+    #every (sql, parameters) sent to the database while the test runs, clear() it to start counting from a point
+    sent = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        sent.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield sent
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+@pytest.fixture
+def car_search(app):
+    #db.create_all() only builds what the models declare, the FTS table & its triggers come from the car_search migration
+    path = Path(__file__).parent.parent / 'migrations' / 'versions' / '3c7a9f2e6b41_car_search.py'
+    spec = importlib.util.spec_from_file_location('car_search_migration', path)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+
+    for statement in migration.SQLITE_UPGRADE:
+        db.session.execute(db.text(statement))
+    db.session.commit()
+    yield
+    db.session.rollback()
+    db.session.execute(db.text('DROP TABLE car_search')) #drop_all takes the triggers with the car table, but not this
+    db.session.commit()
+
+
+@pytest.fixture
+def compressions(monkeypatch):
+    #the encoding of every gzip/deflate done, whether from a cache entry (CachedBody.encoded) or on the way out (compress_response)
+    calls = []
+    def counting(compress):
+        return lambda *args, **kwargs: calls.append(args[1]) or compress(*args, **kwargs)
+    monkeypatch.setattr(cache, 'compress', counting(cache.compress))
+    monkeypatch.setattr(api_routes, 'compress', counting(api_routes.compress))
+    return calls
+
+
+@pytest.fixture
+def make_order(app):
+    #a customer with one order of `lines` different cars, returns (cust_id, order_id, car_ids)
+    def make(cust_id, lines):
+        cars = [Car('Honda', f'Civic{i}', '2019', 'red', 20000, 10, image = 'http://img/civic.png') for i in range(lines)]
+        order = Order()
+        db.session.add_all(cars + [Customer(cust_id), order])
+        db.session.flush()
+        db.session.add_all([carOrder(car.car_id, 1, car.price, order.order_id, cust_id) for car in cars])
+        db.session.commit()
+        return cust_id, order.order_id, [car.car_id for car in cars]
+    return make
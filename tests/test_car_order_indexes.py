@@ -0,0 +1,50 @@
+from car_inventory.models import db
+
+
+
+def car_order_plans(statements):
+    #EXPLAIN QUERY PLAN for every SELECT on car_order the request sent, with the parameters it sent them with
+    connection = db.session.connection().connection.driver_connection
+    return [
+        ' | '.join(row[-1] for row in connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall())
+        for statement, parameters in statements
+        if statement.lstrip().startswith('SELECT') and 'FROM car_order' in statement
+    ]
+
+
+def test_get_order_uses_cust_id_index(client, auth_headers, statements, make_order):
+    cust_id, _, _ = make_order('indexed', 3)
+
+    statements.clear()
+    assert client.get(f'/api/order/{cust_id}', headers = auth_headers).status_code == 200
+
+    plans = car_order_plans(statements)
+    assert plans
+    for plan in plans:
+        assert 'USING INDEX ix_car_order_cust_id' in plan, plan
+
+
+def test_update_order_uses_order_id_car_id_index(client, auth_headers, statements, make_order):
+    _, order_id, (car_id,) = make_order('update', 1)
+
+    statements.clear()
+    response = client.put(f'/api/order/update/{order_id}', headers = auth_headers, json = {'car_id': car_id, 'quantity': 2})
+    assert response.status_code == 200
+
+    plans = car_order_plans(statements)
+    assert plans
+    for plan in plans:
+        assert 'USING INDEX ix_car_order_order_id_car_id' in plan, plan
+
+
+def test_delete_car_order_uses_order_id_car_id_index(client, auth_headers, statements, make_order):
+    _, order_id, (car_id,) = make_order('delete', 1)
+
+    statements.clear()
+    response = client.delete(f'/api/order/delete/{order_id}', headers = auth_headers, json = {'car_id': car_id})
+    assert response.status_code == 200
+
+    plans = car_order_plans(statements)
+    assert plans
+    for plan in plans:
+        assert 'USING INDEX ix_car_order_order_id_car_id' in plan, plan
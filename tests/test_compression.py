@@ -0,0 +1,37 @@
+import gzip
+
+from car_inventory.cache import catalog_cache
+from car_inventory.models import db, Car
+
+
+
+def add_cars(count):
+    db.session.add_all([Car('Honda', f'Civic{i}', '2019', 'red', 20000 + i, 3, image = 'http://img/civic.png') for i in range(count)])
+    db.session.commit()
+
+
+def test_shop_pages_are_compressed_from_the_cache(client, auth_headers):
+    add_cars(60)
+    headers = {**auth_headers, 'Accept-Encoding': 'gzip'}
+
+    plain = client.get('/api/shop', headers = auth_headers)
+    first = client.get('/api/shop', headers = headers)
+    second = client.get('/api/shop', headers = headers)
+
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in first.headers['Vary']
+    assert first.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    assert gzip.decompress(first.data) == plain.data
+    assert second.data == first.data
+
+
+def test_compressed_copies_count_against_the_cache_size(client, auth_headers):
+    add_cars(60)
+
+    client.get('/api/shop', headers = auth_headers)
+    plain_bytes = catalog_cache.stats()['bytes']
+    gzipped = client.get('/api/shop', headers = {**auth_headers, 'Accept-Encoding': 'gzip'})
+    client.get('/api/shop', headers = {**auth_headers, 'Accept-Encoding': 'deflate'})
+
+    assert catalog_cache.stats()['entries'] == 1
+    assert catalog_cache.stats()['bytes'] > plain_bytes + len(gzipped.data)
@@ -0,0 +1,14 @@
+from car_inventory.models import db, Car, carOrder
+
+
+
+def test_deleting_a_car_on_an_order(client, make_order):
+    #the car's order lines are left alone (car_id is NOT NULL, so nulling them out used to fail with a 500)
+    cust_id, order_id, (car_id,) = make_order('ordered', 1)
+
+    response = client.get(f'/shop/delete/{car_id}')
+
+    assert response.status_code == 302
+    assert db.session.get(Car, car_id) is None
+    (line,) = carOrder.query.filter(carOrder.order_id == order_id).all()
+    assert line.car_id == car_id
@@ -0,0 +1,62 @@
+import gzip
+from decimal import Decimal
+
+from car_inventory.models import db, Car
+
+
+
+def counts(facet):
+    return [(item['value'], item['count']) for item in facet]
+
+
+def test_facet_counts(client, auth_headers):
+    db.session.add_all([
+        Car(make, model, year, color, Decimal(price), 1, image = 'http://img/car.png')
+        for make, model, year, color, price in [
+            ('Honda', 'Civic', '1998', 'red', '9999.99'),
+            ('Honda', 'Accord', '2005', 'blue', '10000'), #a band's lower edge belongs to that band
+            ('Honda', 'Fit', '2019', 'red', '29999'),
+            ('Toyota', 'Corolla', '2010', 'red', '30000'),
+            ('Toyota', 'Supra', '1994', 'white', '50000'),
+            ('Ford', 'Mustang', '1967', 'blue', '80000'),
+            ('Ford', 'Focus', '2012', 'white', '15000'),
+        ]
+    ])
+    db.session.commit()
+
+    facets = client.get('/api/shop/facets', headers = auth_headers).json
+    #makes & colors most common first, ties by name; decades & price bands in order, empty ones left out
+    assert counts(facets['make']) == [('Honda', 3), ('Ford', 2), ('Toyota', 2)]
+    assert counts(facets['color']) == [('red', 3), ('blue', 2), ('white', 2)]
+    assert counts(facets['decade']) == [('1960s', 1), ('1990s', 2), ('2000s', 1), ('2010s', 3)]
+    assert counts(facets['price']) == [('0-10000', 1), ('10000-20000', 2), ('20000-30000', 1), ('30000-50000', 1), ('50000+', 2)]
+
+    hondas = client.get('/api/shop/facets?make=Honda', headers = auth_headers).json
+    assert counts(hondas['make']) == [('Honda', 3)]
+    assert counts(hondas['color']) == [('red', 2), ('blue', 1)]
+    assert counts(hondas['decade']) == [('1990s', 1), ('2000s', 1), ('2010s', 1)]
+    assert counts(hondas['price']) == [('0-10000', 1), ('10000-20000', 1), ('20000-30000', 1)]
+
+    cheap = client.get('/api/shop/facets?max_price=20000&color=blue', headers = auth_headers).json
+    assert counts(cheap['make']) == [('Honda', 1)]
+    assert counts(cheap['price']) == [('10000-20000', 1)]
+
+    assert client.get('/api/shop/facets?min_price=abc', headers = auth_headers).status_code == 400
+
+
+def test_facet_hits_serve_the_cached_compressed_copy(client, auth_headers, compressions):
+    #enough distinct makes & colors that the body is worth compressing
+    db.session.add_all([Car(f'Make{i}', 'Model', str(1950 + i), f'color{i}', 1000 * i, 1, image = 'http://img/car.png') for i in range(60)])
+    db.session.commit()
+
+    headers = {**auth_headers, 'Accept-Encoding': 'gzip'}
+    plain = client.get('/api/shop/facets', headers = auth_headers)
+    first = client.get('/api/shop/facets', headers = headers)
+    second = client.get('/api/shop/facets', headers = headers)
+
+    assert len(plain.data) >= client.application.config['COMPRESS_MIN_BYTES']
+    assert compressions == ['gzip']
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in first.headers['Vary']
+    assert gzip.decompress(first.data) == plain.data
+    assert second.data == first.data
@@ -0,0 +1,29 @@
+def order_statements(client, auth_headers, statements, cust_id):
+    statements.clear()
+    response = client.get(f'/api/order/{cust_id}', headers = auth_headers)
+    assert response.status_code == 200
+    return len(statements), response.json
+
+
+def test_get_order_query_count_does_not_grow_with_line_items(client, auth_headers, statements, make_order):
+    #one joined query no matter how many cars are on the order (it used to be one extra query per line item)
+    make_order('one-line', 1)
+    make_order('many-lines', 25)
+
+    one, one_body = order_statements(client, auth_headers, statements, 'one-line')
+    many, many_body = order_statements(client, auth_headers, statements, 'many-lines')
+
+    assert len(one_body) == 1
+    assert len(many_body) == 25
+    assert many == one
+
+
+def test_get_order_merges_car_and_line_item(client, auth_headers, make_order):
+    cust_id, order_id, (car_id,) = make_order('merged', 1)
+
+    (line,) = client.get(f'/api/order/{cust_id}', headers = auth_headers).json
+
+    assert line['car_id'] == car_id
+    assert line['order_id'] == order_id
+    assert line['make'] == 'Honda'
+    assert line['quantity'] == 1
@@ -0,0 +1,63 @@
+import gzip
+
+from car_inventory.models import db, Car
+
+
+
+def add_cars(*cars):
+    cars = [Car(make, model, year, color, 20000, 3, image = 'http://img/car.png', description = description) for make, model, year, color, description in cars]
+    db.session.add_all(cars)
+    db.session.commit()
+    return cars
+
+
+def search(client, auth_headers, q):
+    response = client.get(f'/api/shop/search?q={q}', headers = auth_headers)
+    assert response.status_code == 200
+    return [(car['make'], car['model'], car['year'], car['color']) for car in response.json]
+
+
+def test_search_ranks_make_and_model_above_description(client, auth_headers, car_search):
+    add_cars(
+        ('Honda', 'Accord', '2019', 'red', 'Roomier than a Civic'),
+        ('Honda', 'Civic', '2019', 'red', ''),
+        ('Honda', 'Civic', '2018', 'red', ''),
+        ('Toyota', 'Corolla', '2019', 'red', ''),
+    )
+
+    #every term has to match, the last one as a prefix
+    assert search(client, auth_headers, 'red 2019 civ') == [('Honda', 'Civic', '2019', 'red'), ('Honda', 'Accord', '2019', 'red')]
+    assert search(client, auth_headers, 'toy') == [('Toyota', 'Corolla', '2019', 'red')]
+    assert search(client, auth_headers, 'mustang') == []
+
+
+def test_search_follows_updates_and_deletes(client, auth_headers, car_search):
+    civic, corolla = add_cars(('Honda', 'Civic', '2019', 'red', ''), ('Toyota', 'Corolla', '2019', 'red', ''))
+    assert search(client, auth_headers, 'civic') == [('Honda', 'Civic', '2019', 'red')]
+
+    civic.color = 'blue'
+    db.session.commit()
+    assert search(client, auth_headers, 'red') == [('Toyota', 'Corolla', '2019', 'red')]
+    assert search(client, auth_headers, 'blue civic') == [('Honda', 'Civic', '2019', 'blue')]
+
+    db.session.delete(corolla)
+    db.session.commit()
+    assert search(client, auth_headers, 'red') == []
+    assert search(client, auth_headers, '2019') == [('Honda', 'Civic', '2019', 'blue')]
+
+
+def test_search_hits_serve_the_cached_compressed_copy(client, auth_headers, car_search, statements, compressions):
+    add_cars(*[('Honda', f'Civic{i}', '2019', 'red', 'One careful owner, full service history') for i in range(40)])
+
+    statements.clear()
+    headers = {**auth_headers, 'Accept-Encoding': 'gzip'}
+    plain = client.get('/api/shop/search?q=civic', headers = auth_headers)
+    first = client.get('/api/shop/search?q=civic', headers = headers)
+    second = client.get('/api/shop/search?q=civic', headers = headers)
+
+    assert len([sql for sql, _ in statements if 'car_search' in sql]) == 1
+    assert compressions == ['gzip']
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in first.headers['Vary']
+    assert gzip.decompress(first.data) == plain.data
+    assert second.data == first.data
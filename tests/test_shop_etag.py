@@ -0,0 +1,24 @@
+from car_inventory.models import db, Car
+
+
+
+def test_shop_answers_304_for_strong_and_weak_etags(client, auth_headers):
+    db.session.add(Car('Honda', 'Civic', '2019', 'red', 20000, 3, image = 'http://img/civic.png'))
+    db.session.commit()
+
+    response = client.get('/api/shop', headers = auth_headers)
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+
+    for sent in (etag, f'W/{etag}'):
+        assert client.get('/api/shop', headers = {**auth_headers, 'If-None-Match': sent}).status_code == 304
+        assert client.get('/api/shop/export', headers = {**auth_headers, 'If-None-Match': sent}).status_code == 304
+
+
+def test_shop_etag_changes_with_the_inventory(client, auth_headers):
+    etag = client.get('/api/shop', headers = auth_headers).headers['ETag']
+
+    db.session.add(Car('Honda', 'Civic', '2019', 'red', 20000, 3, image = 'http://img/civic.png'))
+    db.session.commit()
+
+    assert client.get('/api/shop', headers = {**auth_headers, 'If-None-Match': etag}).status_code == 200
@@ -0,0 +1,27 @@
+from car_inventory.cache import catalog_cache
+from car_inventory.models import db, Car, User
+
+
+
+def test_shop_listing_is_rendered_once_per_inventory_version(client, statements):
+    user = User('tester', 'tester@example.com', 'secret')
+    db.session.add_all([user, Car('Honda', 'Civic', '2019', 'red', 20000, 3, image = 'http://img/civic.png', description = 'Low miles')])
+    db.session.commit()
+    with client.session_transaction() as session:
+        session['_user_id'] = user.get_id()
+
+    first = client.get('/')
+    statements.clear()
+    second = client.get('/')
+
+    assert b'Civic' in first.data and b'Low miles' in first.data
+    assert b'ALERT: Quantity is Low' in first.data
+    assert second.data == first.data
+    assert not [sql for sql, _ in statements if 'car.make' in sql] #the cards came from the cache, no cars were loaded
+    (listing, size, _), = [entry for key, entry in catalog_cache.entries.items() if key[0] == 'listing']
+    assert listing in first.data.decode()
+    assert size == len(listing)
+
+    db.session.add(Car('Toyota', 'Corolla', '2018', 'blue', 18000, 30, image = 'http://img/corolla.png'))
+    db.session.commit()
+    assert b'Corolla' in client.get('/').data #a new inventory version renders again